@@ -1,14 +1,40 @@
 from litestar import Litestar
+from litestar.config.compression import CompressionConfig
 
+from app.conditional import NotModified, not_modified_handler
 from app.config import settings
 from app.database import sqlalchemy_plugin
+from app.fixtures import fixtures_plugin
+from app.metrics import metrics_endpoint, metrics_middleware, registry
+from app.response_cache import response_cache
+from app.services.accounts.cache import principal_cache
 from app.services.accounts.controllers import accounts_router
+from app.services.accounts.hashing import hashing_pool
+from app.services.accounts.last_login import last_login_buffer
 from app.services.accounts.security import oauth2_auth
+from app.services.accounts.tokens import token_service
 from app.services.expenses.controllers import expenses_router
+from app.services.expenses.rollups import rollups_plugin
+
+registry.collect("principal_cache", principal_cache.stats)
+registry.collect("token_cache", token_service.stats)
+registry.collect("last_login_buffer", last_login_buffer.stats)
+registry.collect("hashing_pool", hashing_pool.stats)
+registry.collect("response_cache", response_cache.stats)
 
 app = Litestar(
-    route_handlers=[accounts_router, expenses_router],
-    plugins=[sqlalchemy_plugin],
+    route_handlers=[accounts_router, expenses_router, metrics_endpoint],
+    # the response cache goes after the SQLAlchemy plugin, see `ResponseCache`
+    plugins=[sqlalchemy_plugin, response_cache, fixtures_plugin, rollups_plugin],
     on_app_init=[oauth2_auth.on_app_init],
+    on_shutdown=[hashing_pool.shutdown],
+    lifespan=[last_login_buffer.lifespan],
+    middleware=[metrics_middleware],
+    exception_handlers={NotModified: not_modified_handler},
+    compression_config=(
+        CompressionConfig(backend=settings.compression_backend, minimum_size=settings.compression_minimum_size)
+        if settings.compression_backend != "none"
+        else None
+    ),
     debug=settings.debug,
 )
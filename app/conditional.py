@@ -0,0 +1,56 @@
+"""Conditional GETs: strong ETags built from row versions (see `app.database.version_column`).
+
+The handler computes the ETag with a query that only reads versions, and a client that already has the current
+representation gets a 304 without the resource being loaded or serialized.
+"""
+
+import hashlib
+from typing import Any
+
+from litestar import Request, Response
+from litestar.exceptions import HTTPException
+from litestar.status_codes import HTTP_304_NOT_MODIFIED
+from sqlalchemy import ColumnElement, ScalarSelect, func, select
+
+from app.database import Base
+
+
+class NotModified(HTTPException):
+    status_code = HTTP_304_NOT_MODIFIED
+
+    def __init__(self, etag: str) -> None:
+        super().__init__(headers={"ETag": etag})
+        self.etag = etag
+
+
+def not_modified_handler(_: Request[Any, Any, Any], exc: NotModified) -> Response[None]:
+    # a 304 has no body, unlike the responses of the default exception handler
+    return Response(None, status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": exc.etag})
+
+
+def etag(*parts: Any) -> str:
+    """Strong ETag of a representation, from the versions of the rows it's built from and anything else that changes
+    it (like the requested fields)."""
+    return f'"{hashlib.sha1(repr(parts).encode()).hexdigest()}"'
+
+
+def check_not_modified(request: Request[Any, Any, Any], etag: str) -> None:
+    """Raise `NotModified` if `If-None-Match` has `etag`, comparing weakly as RFC 9110 asks for this header."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return
+    if header.strip() == "*" or any(tag.strip().removeprefix("W/") == etag for tag in header.split(",")):
+        raise NotModified(etag)
+
+
+def versions(model: type[Base], *where: ColumnElement[bool]) -> tuple[ScalarSelect[Any], ScalarSelect[Any]]:
+    """Count and sum of the versions of the rows of `model` matching `where`, as scalar subqueries.
+
+    Rows are only inserted or updated, never deleted (expenses are soft deleted), and every UPDATE increments the
+    version, so these change whenever any of the rows does.
+    """
+    version = model.__table__.c.version
+    return (
+        select(func.count()).select_from(model).where(*where).scalar_subquery(),
+        select(func.coalesce(func.sum(version), 0)).where(*where).scalar_subquery(),
+    )
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import AnyUrl, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -5,7 +7,52 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     debug: bool = False
     database_url: AnyUrl = AnyUrl("sqlite:///./test.sqlite3")
+    # use an asyncio engine/session (aiosqlite, psycopg async) instead of the sync one
+    database_async: bool = False
+    # connection pool shared by the request sessions and the authentication lookups
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_recycle: int = 3600
+    database_pool_timeout: int = 30
+    database_pool_pre_ping: bool = False
     secret_key: SecretStr = SecretStr("secret")
+    # lifetime of the access tokens, and verified tokens kept in memory to skip checking their signature again
+    token_expiration_minutes: int = 180
+    token_cache_size: int = 4096
+    # page size of the list endpoints when the client doesn't ask for one, and the largest allowed
+    default_page_size: int = 20
+    max_page_size: int = 100
+    # authenticated users kept in memory between requests (entries, seconds)
+    principal_cache_size: int = 1024
+    principal_cache_ttl: int = 60
+    # expenses written per transaction by the bulk import, and the largest chunk a client may ask for
+    import_chunk_size: int = 500
+    max_import_chunk_size: int = 5000
+    # rows fetched per round trip by the streaming exports
+    export_batch_size: int = 1000
+    # threads hashing passwords, and operations that may wait for one before requests get a 503
+    hashing_workers: int = 2
+    hashing_queue_size: int = 16
+    # last logins are buffered and written every `last_login_flush_interval` seconds, or sooner when this many pile up
+    last_login_flush_interval: float = 5.0
+    last_login_buffer_size: int = 1000
+    # compression of the responses larger than `compression_minimum_size` bytes, "none" to disable it ("brotli" needs
+    # `litestar[brotli]`, clients that don't accept it get gzip)
+    compression_backend: Literal["gzip", "brotli", "none"] = "gzip"
+    compression_minimum_size: int = 500
+    # worker processes serving the app, read from `WEB_CONCURRENCY` like `litestar run` and uvicorn do; set it there
+    # rather than with `--wc`, which the app can't see
+    web_concurrency: int = 1
+    # cached responses of the hot read endpoints: "memory" (one cache per worker) or a redis:// URL shared by all the
+    # workers (needs `litestar[redis]`), and seconds they are kept, 0 to disable it. A write only invalidates the
+    # memory cache of the worker that served it, so with more than one worker the memory cache is disabled: the others
+    # would serve stale responses for up to the TTL
+    response_cache_store: str = "memory"
+    response_cache_ttl: int = 60
+    # statements taking longer than this many seconds are logged with the route that ran them
+    slow_query_threshold: float = 0.5
+    # serve `/metrics` without a token, e.g. for a Prometheus scraper that can only reach it from a private network
+    metrics_public: bool = False
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -1,18 +1,219 @@
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import TYPE_CHECKING, Any, Callable, Concatenate, Generic, ParamSpec, TypeAlias, TypeVar
+
+import anyio
 from advanced_alchemy.base import CommonTableAttributes
+from advanced_alchemy.config.asyncio import AsyncSessionConfig
 from advanced_alchemy.config.sync import SyncSessionConfig
-from advanced_alchemy.extensions.litestar import SQLAlchemyPlugin, sync_autocommit_before_send_handler
-from litestar.contrib.sqlalchemy.plugins import SQLAlchemySyncConfig
-from sqlalchemy.orm import DeclarativeBase
+from advanced_alchemy.extensions.litestar import (
+    EngineConfig,
+    SQLAlchemyPlugin,
+    async_autocommit_before_send_handler,
+    sync_autocommit_before_send_handler,
+)
+from litestar.contrib.sqlalchemy.plugins import SQLAlchemyAsyncConfig, SQLAlchemySyncConfig
+from litestar.dto import dto_field
+from sqlalchemy import Row, Select, event, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import DeclarativeBase, MappedColumn, Session, mapped_column, scoped_session
 
 from app.config import settings
+from app.metrics import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument
+
+RepositoryT = TypeVar("RepositoryT")
+ReturnT = TypeVar("ReturnT")
+P = ParamSpec("P")
+
+# asyncio driver used for each backend when `settings.database_async` is enabled
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "psycopg"}
+
+
+def async_connection_string(url: str) -> str:
+    """Return the connection string with the driver replaced by the asyncio one of the same backend."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend, parsed.get_driver_name())
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
 
-sqlalchemy_config = SQLAlchemySyncConfig(
-    connection_string=settings.database_url.unicode_string(),
-    session_config=SyncSessionConfig(expire_on_commit=False),
-    before_send_handler=sync_autocommit_before_send_handler,
+
+engine_config = EngineConfig(
+    pool_size=settings.database_pool_size,
+    max_overflow=settings.database_max_overflow,
+    pool_recycle=settings.database_pool_recycle,
+    pool_timeout=settings.database_pool_timeout,
+    pool_pre_ping=settings.database_pool_pre_ping,
 )
+
+# Each request is a unit of work: repositories only flush, and the `before_send_handler` commits the request session
+# once when the response is a 2xx (rolling it back otherwise). Bulk paths use savepoints (`Session.begin_nested`).
+sqlalchemy_config: SQLAlchemyAsyncConfig | SQLAlchemySyncConfig
+if settings.database_async:
+    connection_string = async_connection_string(settings.database_url.unicode_string())
+    # the default pool, with its checkouts timed (aiosqlite defaults to NullPool, which opens a new connection for
+    # every session)
+    engine_config.poolclass = TimedAsyncAdaptedQueuePool
+    sqlalchemy_config = SQLAlchemyAsyncConfig(
+        connection_string=connection_string,
+        engine_config=engine_config,
+        session_config=AsyncSessionConfig(expire_on_commit=False),
+        before_send_handler=async_autocommit_before_send_handler,
+    )
+else:
+    engine_config.poolclass = TimedQueuePool
+    sqlalchemy_config = SQLAlchemySyncConfig(
+        connection_string=settings.database_url.unicode_string(),
+        engine_config=engine_config,
+        session_config=SyncSessionConfig(expire_on_commit=False),
+        before_send_handler=sync_autocommit_before_send_handler,
+    )
+# `get_engine()` and `create_session_maker()` build new instances on every call unless these are set, so create them
+# once here and let the plugin and anything else that needs a session share the same pool
+sqlalchemy_config.engine_instance = sqlalchemy_config.get_engine()
+engine = sqlalchemy_config.engine_instance
+instrument(engine.sync_engine if isinstance(engine, AsyncEngine) else engine)
+sqlalchemy_config.session_maker = sqlalchemy_config.create_session_maker()
 sqlalchemy_plugin = SQLAlchemyPlugin(config=sqlalchemy_config)
 
+# type of the `db_session` dependency; litestar validates it at runtime, so it must be the concrete one
+if TYPE_CHECKING:
+    DatabaseSession: TypeAlias = AsyncSession | Session
+else:
+    DatabaseSession = AsyncSession if settings.database_async else Session
+
 
 class Base(CommonTableAttributes, DeclarativeBase):
     pass
+
+
+def version_column(table: str) -> MappedColumn[int]:
+    """Version of a row, incremented by every UPDATE of it: ORM flushes as well as bulk and Core statements, since
+    SQLAlchemy adds `onupdate` to any UPDATE that doesn't set the column itself.
+
+    Used for ETags (see `app.conditional`); it's not part of any DTO.
+    """
+    return mapped_column(
+        default=1, server_default="1", onupdate=literal_column(f"{table}.version") + 1, info=dto_field("private")
+    )
+
+
+class AsyncRepository(Generic[RepositoryT]):
+    """Awaitable wrapper around a sync repository.
+
+    The queries are written once, in the sync repository, and run against the request session without blocking the
+    event loop: through ``AsyncSession.run_sync`` when the async engine is enabled, or in a worker thread otherwise.
+    """
+
+    repository_type: Callable[..., RepositoryT]
+
+    def __init__(self, session: DatabaseSession) -> None:
+        self.session = session
+
+    async def run(
+        self, method: Callable[Concatenate[RepositoryT, P], ReturnT], *args: P.args, **kwargs: P.kwargs
+    ) -> ReturnT:
+        """Call `method` on a sync repository bound to the current session."""
+
+        def call(session: Session) -> ReturnT:
+            return method(self.repository_type(session=session), *args, **kwargs)
+
+        if isinstance(self.session, AsyncSession):
+            return await self.session.run_sync(call)
+        return await anyio.to_thread.run_sync(call, self.session)
+
+
+def on_commit(session: Session | scoped_session[Session], callback: Callable[[], None]) -> None:
+    """Run `callback` once the current transaction of `session` is committed.
+
+    Repositories don't commit, the request's unit of work does (the autocommit `before_send_handler`), so anything
+    that must only happen once the changes are visible to other sessions, like invalidating a cache, goes here.
+    """
+    target = session() if isinstance(session, scoped_session) else session
+    target.info.setdefault("on_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def run_on_commit(session: Session) -> None:
+    # `after_commit` is also emitted when a savepoint is released
+    if not session.in_nested_transaction():
+        for callback in session.info.pop("on_commit", []):
+            callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_on_commit(session: Session) -> None:
+    if not session.in_nested_transaction():
+        session.info.pop("on_commit", None)
+
+
+def stream_partitions(
+    statement: Select[Any], size: int
+) -> Iterator[Sequence[Row[Any]]] | AsyncIterator[Sequence[Row[Any]]]:
+    """Rows of `statement` in batches of `size`, fetched through a server side cursor (`yield_per`).
+
+    Meant for streaming responses, so it uses a session of its own: the request session is closed as soon as the
+    response starts. The iterator is async when the async engine is enabled.
+    """
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(sqlalchemy_config, SQLAlchemyAsyncConfig):
+        session_maker = sqlalchemy_config.create_session_maker()
+
+        async def async_partitions() -> AsyncIterator[Sequence[Row[Any]]]:
+            async with session_maker() as session:
+                result = await session.stream(statement)
+                async for partition in result.partitions():
+                    yield partition
+
+        return async_partitions()
+
+    sync_session_maker = sqlalchemy_config.create_session_maker()
+
+    def partitions() -> Iterator[Sequence[Row[Any]]]:
+        with sync_session_maker() as session:
+            yield from session.execute(statement).partitions()
+
+    return partitions()
+
+
+async def run_in_new_session(function: Callable[[Session], ReturnT]) -> ReturnT:
+    """Call `function` with a session of its own and commit it, for work done outside of a request."""
+    if isinstance(sqlalchemy_config, SQLAlchemyAsyncConfig):
+        async with sqlalchemy_config.create_session_maker()() as async_session:
+            result = await async_session.run_sync(function)
+            await async_session.commit()
+            return result
+
+    session_maker = sqlalchemy_config.create_session_maker()
+
+    def call() -> ReturnT:
+        with session_maker() as session:
+            result = function(session)
+            session.commit()
+            return result
+
+    return await anyio.to_thread.run_sync(call)
+
+
+# INSERT ... ON CONFLICT constructs of the supported backends
+UPSERTS: dict[str, Callable[[Any], postgresql.Insert | sqlite.Insert]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def increment(
+    session: Session | scoped_session[Session], model: type[Base], key: list[str], rows: list[dict[str, Any]]
+) -> None:
+    """Add the values of `rows` to the matching rows of `model` (by the `key` columns), inserting the missing ones.
+
+    All rows must have the same columns, and they are sent in a single executemany.
+    """
+    if not rows:
+        return
+    statement = UPSERTS[session.get_bind().dialect.name](model)
+    statement = statement.on_conflict_do_update(
+        index_elements=key,
+        set_={column: getattr(model, column) + statement.excluded[column] for column in rows[0] if column not in key},
+    )
+    session.execute(statement, rows)
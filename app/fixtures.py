@@ -0,0 +1,204 @@
+"""Synthetic users, expenses and debts at scale, to look at the query plans of the list and per user endpoints.
+
+`litestar fixtures generate` appends the rows to the configured database; the same seed and options always generate
+the same rows (ids start after the existing ones). The data is skewed like real usage:
+
+- creators and debtors are drawn from a Zipf distribution over the users, so a few heavy users have most expenses and
+  debts;
+- the number of debtors of an expense follows a Pareto distribution: mostly one or two, with some large groups;
+- a share of the expenses is fully paid, the rest have a mix of paid and unpaid debts, and a few are soft deleted.
+
+Rows are written in batches, each in its own transaction: with `COPY` on PostgreSQL and executemany elsewhere. The
+balance ledger is updated with the unpaid debts of every batch, like the write paths of the API do, and the report
+rollups are rebuilt at the end.
+"""
+
+import bisect
+import itertools
+import random
+import time
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta
+from typing import Any
+
+import click
+from click import Group
+from litestar.plugins import CLIPluginProtocol
+from sqlalchemy import Connection, create_engine, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import Base
+from app.services.accounts.hashing import password_hasher
+from app.services.accounts.models import User
+from app.services.expenses import ledger, rollups
+from app.services.expenses.models import Debt, Expense, ExpenseStatus
+
+PASSWORD = "fixtures"
+
+
+def bulk_insert(connection: Connection, model: type[Base], rows: Sequence[dict[str, Any]]) -> None:
+    """Insert `rows`, which must all have the same columns, with `COPY` on PostgreSQL or an executemany otherwise."""
+    if not rows:
+        return
+    if connection.dialect.name != "postgresql":
+        connection.execute(insert(model), rows)
+        return
+    columns = list(rows[0])
+    cursor = connection.connection.dbapi_connection.cursor()  # type: ignore[union-attr]
+    with cursor.copy(f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row([row[column] for column in columns])
+
+
+class Generator:
+    def __init__(self, rng: random.Random, user_ids: Sequence[int], skew: float) -> None:
+        self.rng = rng
+        # heavy users are spread over the ids instead of being the first ones
+        self.user_ids = list(user_ids)
+        rng.shuffle(self.user_ids)
+        self.weights = list(itertools.accumulate(1 / rank**skew for rank in range(1, len(self.user_ids) + 1)))
+
+    def user(self) -> int:
+        return self.user_ids[bisect.bisect(self.weights, self.rng.random() * self.weights[-1])]
+
+    def debtors(self, created_by_id: int, count: int) -> list[int]:
+        count = min(count, len(self.user_ids) - 1)
+        debtors: set[int] = set()
+        # large groups run out of heavy users, so fill them uniformly after a few attempts
+        for _ in range(4 * count):
+            if len(debtors) == count:
+                break
+            debtors.add(self.user())
+            debtors.discard(created_by_id)
+        while len(debtors) < count:
+            debtors.add(self.rng.choice(self.user_ids))
+            debtors.discard(created_by_id)
+        return sorted(debtors)
+
+
+def generate(
+    session: Session, generator: Generator, first_id: int, count: int, options: dict[str, Any]
+) -> tuple[int, int]:
+    """Insert `count` expenses with ids from `first_id` and their debts; returns the number of expenses and debts."""
+    rng = generator.rng
+    end: datetime = options["end"]
+    expenses, debts = [], []
+    unpaid: list[ledger.Entry] = []
+    for expense_id in range(first_id, first_id + count):
+        created_by_id = generator.user()
+        debtor_ids = generator.debtors(created_by_id, min(options["max_group"], int(rng.paretovariate(1.5))))
+        amount = max(1, int(rng.lognormvariate(8, 1.2)))
+        # the same split as `ExpenseRepository.create_with_debts`
+        amount_per_person = int(amount / (len(debtor_ids) + 1))
+        created_at = end - timedelta(seconds=rng.randrange(options["days"] * 86400))
+        fully_paid = rng.random() < options["paid_ratio"]
+        paid = [fully_paid or rng.random() < 0.3 for _ in debtor_ids]
+        is_deleted = rng.random() < options["deleted_ratio"]
+        expenses.append(
+            {
+                "id": expense_id,
+                "title": f"Gasto {expense_id}",
+                "description": None,
+                "datetime": created_at,
+                "amount": amount,
+                "status": (ExpenseStatus.PAID if all(paid) else ExpenseStatus.PENDING).name,
+                "is_deleted": is_deleted,
+                "created_by_id": created_by_id,
+            }
+        )
+        for user_id, is_paid in zip(debtor_ids, paid):
+            paid_on = min(end, created_at + timedelta(seconds=rng.randrange(30 * 86400))) if is_paid else None
+            # paying a debt zeroes its amount, as in `ExpenseRepository.update_expense` and `settle`
+            debt_amount = 0 if is_paid else amount_per_person
+            debts.append({"expense_id": expense_id, "user_id": user_id, "amount": debt_amount, "paid_on": paid_on})
+            if not is_paid and not is_deleted:
+                unpaid.append((user_id, created_by_id, amount_per_person))
+
+    connection = session.connection()
+    bulk_insert(connection, Expense, expenses)
+    bulk_insert(connection, Debt, debts)
+    ledger.add(session, unpaid)
+    return len(expenses), len(debts)
+
+
+def batches(first_id: int, count: int, size: int) -> Iterable[tuple[int, int]]:
+    for start in range(first_id, first_id + count, size):
+        yield start, min(size, first_id + count - start)
+
+
+class FixturesCLIPlugin(CLIPluginProtocol):
+    def on_cli_init(self, cli: Group) -> None:
+        @cli.group(name="fixtures")
+        def fixtures_group() -> None:
+            """Synthetic data for load and query plan testing."""
+
+        @fixtures_group.command(name="generate")
+        @click.option("--users", type=click.IntRange(min=1), default=10_000, show_default=True, help="Users to create.")
+        @click.option("--expenses", default=1_000_000, show_default=True, help="Expenses to create.")
+        @click.option("--max-group", default=50, show_default=True, help="Largest number of debtors of an expense.")
+        @click.option("--skew", default=1.1, show_default=True, help="Exponent of the Zipf distribution of the users.")
+        @click.option("--paid-ratio", default=0.5, show_default=True, help="Share of fully paid expenses.")
+        @click.option("--deleted-ratio", default=0.01, show_default=True, help="Share of soft deleted expenses.")
+        @click.option("--days", default=365, show_default=True, help="Expenses are spread over this many days.")
+        @click.option(
+            "--end", type=click.DateTime(), default="2025-01-01", show_default=True, help="Date of the newest expense."
+        )
+        @click.option("--seed", default=0, show_default=True)
+        @click.option("--batch-size", default=10_000, show_default=True, help="Expenses written per transaction.")
+        def generate_command(users: int, expenses: int, seed: int, batch_size: int, **options: Any) -> None:
+            """Append users, expenses and debts to the database (the users' password is "fixtures")."""
+            rng = random.Random(seed)
+            # a sync engine of its own: bulk loading doesn't need the app's pool or the async driver
+            engine = create_engine(settings.database_url.unicode_string())
+            started = time.perf_counter()
+            with Session(engine) as session:
+                with session.begin():
+                    first_user_id = (session.scalar(select(func.max(User.id))) or 0) + 1
+                    first_expense_id = (session.scalar(select(func.max(Expense.id))) or 0) + 1
+                password = password_hasher.hash(PASSWORD)
+                for start, count in batches(first_user_id, users, batch_size):
+                    with session.begin():
+                        bulk_insert(
+                            session.connection(),
+                            User,
+                            [
+                                {
+                                    "id": user_id,
+                                    "username": f"fixture{user_id}",
+                                    "full_name": f"Usuario {user_id}",
+                                    "email": f"fixture{user_id}@example.com",
+                                    "password": password,
+                                    "is_active": True,
+                                }
+                                for user_id in range(start, start + count)
+                            ],
+                        )
+                click.echo(f"{users} users")
+
+                with session.begin():
+                    all_user_ids = session.scalars(select(User.id).order_by(User.id)).all()
+                generator = Generator(rng, all_user_ids, options["skew"])
+                total_expenses = total_debts = 0
+                for start, count in batches(first_expense_id, expenses, batch_size):
+                    with session.begin():
+                        created, debts = generate(session, generator, start, count, options)
+                    total_expenses += created
+                    total_debts += debts
+                    elapsed = time.perf_counter() - started
+                    click.echo(f"{total_expenses} expenses, {total_debts} debts ({total_expenses / elapsed:.0f}/s)")
+
+                with session.begin():
+                    rollups.rebuild(session)
+                    if session.get_bind().dialect.name == "postgresql":
+                        # the ids were given explicitly, so the sequences are behind
+                        for table in (User.__tablename__, Expense.__tablename__):
+                            sequence = f"pg_get_serial_sequence('{table}', 'id')"
+                            session.execute(text(f"SELECT setval({sequence}, max(id)) FROM {table}"))
+                    # fresh statistics for the planner
+                    session.execute(text("ANALYZE"))
+            engine.dispose()
+            click.echo(f"Done in {time.perf_counter() - started:.1f} s")
+
+
+fixtures_plugin = FixturesCLIPlugin()
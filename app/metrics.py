@@ -0,0 +1,250 @@
+"""Request and database metrics, served in the Prometheus text format at `/metrics`.
+
+Every request records its latency, and the number of statements it ran and the time they took; the engine events
+below attribute statements to the request being served through a context variable (it's copied into the worker
+threads and greenlets that run the repositories). Statements slower than `settings.slow_query_threshold` are logged
+with their route. The `stats()` of the in-process caches and pools are read when scraped.
+"""
+
+import bisect
+import logging
+import threading
+from collections.abc import Callable, Sequence
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Optional
+
+from litestar import MediaType, get
+from litestar.types import ASGIApp, Message, Receive, Scope, Send
+from litestar.utils import join_paths
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection, QueuePool
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """Cumulative histogram by label values."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> (count per bucket, +Inf included), sum
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def totals(self) -> tuple[int, float]:
+        """Number and sum of all the values observed."""
+        with self._lock:
+            return sum(sum(counts) for counts, _ in self._series.values()), sum(t[0] for _, t in self._series.values())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(values, list(counts), total[0]) for values, (counts, total) in self._series.items()]
+        for values, counts, total in series:
+            labels = render_labels(self.labels, values)
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        lines += [f"{self.name}{{{render_labels(self.labels, labels)}}} {value}" for labels, value in values]
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Histogram | Counter] = []
+        self.collectors: dict[str, Callable[[], dict[str, int]]] = {}
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]) -> Histogram:
+        histogram = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str]) -> Counter:
+        counter = Counter(name, documentation, labels)
+        self.metrics.append(counter)
+        return counter
+
+    def collect(self, prefix: str, stats: Callable[[], dict[str, int]]) -> None:
+        """Export each value of `stats()` as a gauge named `<prefix>_<key>`."""
+        self.collectors[prefix] = stats
+
+    def render(self) -> str:
+        lines = [line for metric in self.metrics for line in metric.render()]
+        for prefix, stats in self.collectors.items():
+            for key, value in stats().items():
+                lines += [f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Latency of the requests.", ["method", "route", "status"], LATENCY_BUCKETS
+)
+REQUEST_QUERIES = registry.histogram(
+    "http_request_db_queries", "Statements executed by each request.", ["route"], QUERY_BUCKETS
+)
+REQUEST_DB_TIME = registry.histogram(
+    "http_request_db_seconds", "Time spent executing statements by each request.", ["route"], LATENCY_BUCKETS
+)
+POOL_CHECKOUT = registry.histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool, waiting included.", [], LATENCY_BUCKETS
+)
+SLOW_QUERIES = registry.counter("db_slow_queries_total", "Statements slower than the threshold.", ["route"])
+
+
+@dataclass
+class RequestMetrics:
+    route: str
+    queries: int = 0
+    db_time: float = 0.0
+
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+# route handler id -> its full path templates
+route_paths: dict[int, list[str]] = {}
+
+
+def route_label(scope: Scope) -> str:
+    """Path template of the matched route handler, e.g. `/expenses/expenses/{expense_id:int}`.
+
+    Not `scope["path_template"]`: Litestar takes it from a trie node that nested routes share, so requests to
+    `/accounts/users/{user_id:int}/debts` would be labelled `/accounts/users/{user_id:int}/debts/export`.
+    """
+    handler = scope.get("route_handler")
+    if handler is None:
+        return scope["path"]
+    paths = route_paths.get(id(handler))
+    if paths is None:
+        prefix = [getattr(layer, "path", "") for layer in handler.ownership_layers[:-1]]
+        paths = route_paths[id(handler)] = sorted(join_paths([*prefix, path]) for path in handler.paths)
+    # a handler may be registered with several paths
+    template: Optional[str] = scope.get("path_template")
+    return template if template in paths else paths[0]
+
+
+def metrics_middleware(app: ASGIApp) -> ASGIApp:
+    async def middleware(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+        metrics = RequestMetrics(route=route_label(scope))
+        token = current_request.set(metrics)
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            # the request session is committed by a `before_send` hook, so its statements are counted here too
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(perf_counter() - start, scope["method"], metrics.route, str(status))
+            REQUEST_QUERIES.observe(metrics.queries, metrics.route)
+            REQUEST_DB_TIME.observe(metrics.db_time, metrics.route)
+            current_request.reset(token)
+
+    return middleware
+
+
+def before_cursor_execute(connection: Any, *_: Any) -> None:
+    connection.info.setdefault("query_start", []).append(perf_counter())
+
+
+def after_cursor_execute(connection: Any, cursor: Any, statement: str, *_: Any) -> None:
+    elapsed = perf_counter() - connection.info["query_start"].pop()
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.db_time += elapsed
+    if elapsed >= settings.slow_query_threshold:
+        route = metrics.route if metrics is not None else "-"
+        SLOW_QUERIES.inc(route)
+        logger.warning("Slow query (%.3f s) in %s: %s", elapsed, route, statement)
+
+
+def handle_error(context: Any) -> None:
+    # `after_cursor_execute` is not emitted for statements that fail
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def instrument(engine: Engine) -> None:
+    """Time the statements executed through `engine` (the sync one of an `AsyncEngine`)."""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class TimedCheckout:
+    """Pool mixin recording how long checkouts take, which is mostly waiting for a connection when the pool is busy."""
+
+    def connect(self) -> PoolProxiedConnection:
+        start = perf_counter()
+        try:
+            return super().connect()  # type: ignore[misc]
+        finally:
+            POOL_CHECKOUT.observe(perf_counter() - start)
+
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+@get("/metrics", media_type=MediaType.TEXT, include_in_schema=False, sync_to_thread=False)
+def metrics_endpoint() -> str:
+    return registry.render()
@@ -0,0 +1,32 @@
+from typing import Any, Callable, Optional, TypeVar
+
+from litestar.pagination import CursorPagination
+from sqlalchemy import Select
+from sqlalchemy.orm import InstrumentedAttribute
+
+from app.config import settings
+
+T = TypeVar("T")
+SelectT = TypeVar("SelectT", bound=Select[Any])
+
+
+def page_size(limit: int) -> int:
+    """Cap the page size requested by the client."""
+    return min(limit, settings.max_page_size)
+
+
+def keyset(statement: SelectT, key: InstrumentedAttribute[int], cursor: Optional[int], limit: int) -> SelectT:
+    """Restrict `statement` to the page of rows after `cursor`, ordered by `key`.
+
+    One extra row is fetched to know whether there is a next page, see `to_page`.
+    """
+    if cursor is not None:
+        statement = statement.where(key > cursor)
+    return statement.order_by(key).limit(limit + 1)
+
+
+def to_page(items: list[T], limit: int, key: Callable[[T], int]) -> CursorPagination[int, T]:
+    """Build the response for rows fetched with `keyset`, `cursor` is None on the last page."""
+    has_next = len(items) > limit
+    items = items[:limit]
+    return CursorPagination(items=items, results_per_page=limit, cursor=key(items[-1]) if has_next else None)
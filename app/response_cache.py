@@ -0,0 +1,129 @@
+"""Read-through cache of the encoded responses of hot read endpoints, kept in a litestar `Store`.
+
+Entries are grouped in scopes (`"expenses"`, `"users:3"`, ...) that the write paths invalidate as a whole once their
+transaction commits. Each scope has a generation in the store which is part of the keys of its entries; invalidating
+the scope replaces the generation, so its old entries are never read again and just expire.
+"""
+
+import logging
+import threading
+from typing import Any, Awaitable, Callable, TypeVar, cast
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import msgspec
+from litestar import Request
+from litestar.config.app import AppConfig
+from litestar.plugins import InitPluginProtocol
+from litestar.serialization import encode_json
+from litestar.stores.base import Store
+from litestar.stores.memory import MemoryStore
+from litestar.types import Message, Scope
+from sqlalchemy.orm import Session, scoped_session
+
+from app.config import settings
+from app.database import on_commit
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def create_store(url: str) -> Store:
+    """`"memory"` for a store of each worker, or a `redis://` URL for one shared by all of them."""
+    if url == "memory":
+        return MemoryStore()
+    # optional dependency, `litestar[redis]`
+    from litestar.stores.redis import RedisStore
+
+    return RedisStore.with_client(url=url, namespace="response_cache")
+
+
+class ResponseCache(InitPluginProtocol):
+    """Cache of JSON responses, keyed by user, path and query string within a scope.
+
+    Also a plugin: invalidations are applied in a `before_send` hook that runs after the one committing the request
+    session, so they are in the store before the client that made the write gets its response.
+    """
+
+    def __init__(self, store: Store, ttl: int) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._pending: set[str] = set()
+        # commits happen in worker threads when the sync engine is used
+        self._lock = threading.Lock()
+
+    def on_app_init(self, app_config: AppConfig) -> AppConfig:
+        app_config.before_send.append(self.before_send)
+        app_config.on_shutdown.append(self.shutdown)
+        return app_config
+
+    async def get_or_set(
+        self, scope: str, request: Request[Any, Any, Any], load: Callable[[], Awaitable[T]]
+    ) -> T:
+        """The cached response for `request` in `scope`, or the one returned by `load`, cached for next time.
+
+        The JSON is returned as a `msgspec.Raw`, which litestar writes out as is. It's typed as what `load` returns
+        because that's what it contains.
+        """
+        if self.ttl <= 0:
+            return await load()
+        await self.flush()
+        generation = await self.store.get(f"{scope}:generation")
+        query = urlencode(sorted(request.query_params.multi_items()))
+        key = f"{scope}:{generation.decode() if generation else 0}:{request.user.id}:{request.url.path}?{query}"
+        cached = await self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cast(T, msgspec.Raw(cached))
+        self.misses += 1
+        content = encode_json(await load())
+        await self.store.set(key, content, expires_in=self.ttl)
+        return cast(T, msgspec.Raw(content))
+
+    def invalidate_on_commit(self, session: Session | scoped_session[Session], *scopes: str) -> None:
+        """Invalidate `scopes` once the transaction of `session` commits."""
+        if self.ttl <= 0:
+            return
+
+        def invalidate() -> None:
+            with self._lock:
+                self._pending.update(scopes)
+
+        on_commit(session, invalidate)
+
+    async def flush(self) -> None:
+        """Apply the invalidations of the transactions committed so far."""
+        with self._lock:
+            scopes, self._pending = self._pending, set()
+        for scope in scopes:
+            # entries live `ttl` seconds, so once the generation expires all those of older generations have too
+            await self.store.set(f"{scope}:generation", uuid4().hex, expires_in=self.ttl)
+        self.invalidations += len(scopes)
+
+    async def before_send(self, message: Message, _: Scope) -> None:
+        if message["type"] == "http.response.start":
+            await self.flush()
+
+    async def shutdown(self) -> None:
+        await self.store.__aexit__(None, None, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+def cache_ttl(store: str, ttl: int, workers: int) -> int:
+    """`ttl`, or 0 to disable the cache when it's kept in memory and there are several workers (see `Settings`)."""
+    if store == "memory" and workers > 1 and ttl > 0:
+        logger.warning("Response cache disabled: the memory store can't be invalidated across %d workers", workers)
+        return 0
+    return ttl
+
+
+response_cache = ResponseCache(
+    create_store(settings.response_cache_store),
+    cache_ttl(settings.response_cache_store, settings.response_cache_ttl, settings.web_concurrency),
+)
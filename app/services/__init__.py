@@ -1,4 +1,4 @@
 # ruff: noqa: F401
 # This is neccessary to prevent errors when using SQLAlchemy mappings
 from .accounts.models import User
-from .expenses.models import Debt, Expense
+from .expenses.models import Debt, DebtRollup, Expense, ExpenseRollup, PairBalance, UserBalance
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.config import settings
+
+from .models import User
+
+# columns kept for the authenticated user; the password is never needed to authorize a request
+PRINCIPAL_COLUMNS = [column.key for column in User.__table__.columns if column.key not in {"password", "version"}]
+
+
+class PrincipalCache:
+    """In-process LRU cache of authenticated users, with a time to live for each entry.
+
+    Entries are keyed by username (the token's `sub`) and can also be invalidated by user id. Each worker has its own
+    cache, so the TTL bounds how long another worker may keep serving a user that was changed elsewhere.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._usernames: dict[int, str] = {}
+        # repositories run in worker threads when the sync engine is used
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[User]:
+        """Return a detached copy of the cached user, or None if it isn't cached or has expired."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, values = entry
+            if expires_at < time.monotonic():
+                self._remove(username)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+        return User(**values)
+
+    def set(self, user: User) -> None:
+        values = {key: getattr(user, key) for key in PRINCIPAL_COLUMNS}
+        with self._lock:
+            self._remove(user.username)
+            self._entries[user.username] = (time.monotonic() + self.ttl, values)
+            self._usernames[user.id] = user.username
+            while len(self._entries) > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._usernames.pop(evicted["id"], None)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            username = self._usernames.get(user_id)
+            if username is not None:
+                self._remove(username)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._usernames.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, username: str) -> None:
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self._usernames.pop(entry[1]["id"], None)
+
+
+principal_cache = PrincipalCache(max_size=settings.principal_cache_size, ttl=settings.principal_cache_ttl)
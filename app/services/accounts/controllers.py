@@ -1,4 +1,5 @@
-from typing import Annotated, Any, Collection
+from operator import attrgetter
+from typing import Annotated, Any, Collection, Optional
 
 from advanced_alchemy.exceptions import IntegrityError, NotFoundError
 from litestar import Controller, Request, Response, Router, delete, get, patch, post
@@ -6,14 +7,40 @@ from litestar.di import Provide
 from litestar.dto import DTOData
 from litestar.enums import RequestEncodingType
 from litestar.exceptions import HTTPException
-from litestar.params import Body
+from litestar.pagination import CursorPagination
+from litestar.params import Body, Parameter
+from litestar.response import Stream
 from litestar.security.jwt import Token
 from litestar.status_codes import HTTP_200_OK
 from pydantic import BaseModel
-from .dtos import Login, LoginDTO, UserCreateDTO, UserDTO, UserFullDTO, UserUpdateDTO, ChangePasswordDTO, DebtDTO
+
+from app.conditional import check_not_modified, etag
+from app.config import settings
+from app.pagination import page_size, to_page
+from app.response_cache import response_cache
+from app.serialization import requested_fields
+from app.services.expenses.dtos import DebtRow, ExpenseRecord
+from app.services.expenses.repositories import ExpenseAsyncRepository, provide_expense_repository
+from app.streaming import ExportFormat, export
+
+from .dtos import (
+    USER_FIELDS,
+    ChangePasswordDTO,
+    DebtDTO,
+    Login,
+    LoginDTO,
+    UserCreateDTO,
+    UserDTO,
+    UserFullDTO,
+    UserRow,
+    UserUpdateDTO,
+)
+from .exports import debts_statement, expenses_statement
+from .last_login import last_login_buffer
 from .models import User
-from .repositories import UserRepository, password_hasher, provide_user_repository
+from .repositories import UserAsyncRepository, provide_user_repository
 from .security import oauth2_auth
+from .tokens import token_service
 
 
 class UserController(Controller):
@@ -24,81 +51,122 @@ class UserController(Controller):
     return_dto = UserDTO
     dependencies = {"users_repo": Provide(provide_user_repository)}
 
-    @get()
-    async def list_users(self, users_repo: UserRepository) -> list[User]:
-        return users_repo.list()
+    @get(return_dto=None)
+    async def list_users(
+        self,
+        users_repo: UserAsyncRepository,
+        cursor: Optional[int] = None,
+        limit: Annotated[int, Parameter(ge=1)] = settings.default_page_size,
+        is_active: Optional[bool] = None,
+        fields: Optional[str] = None,
+    ) -> CursorPagination[int, UserRow]:
+        """`fields` is a comma separated list of the fields to return (`id` is always included)."""
+        limit = page_size(limit)
+        users = await users_repo.list(
+            cursor=cursor, limit=limit, is_active=is_active, fields=requested_fields(fields, USER_FIELDS)
+        )
+        return to_page(users, limit, attrgetter("id"))
 
     @post(dto=UserCreateDTO)
-    async def create_user(self, users_repo: UserRepository, data: User) -> User:
+    async def create_user(self, users_repo: UserAsyncRepository, data: User) -> User:
         try:
-            return users_repo.add_with_password_hash(data)
+            return await users_repo.add_with_password_hash(data)
         except IntegrityError:
             raise HTTPException(detail="Username and/or email already in use", status_code=400)
 
     @get("/me", return_dto=UserFullDTO)
-    async def get_my_user(self, request: "Request[User, Token, Any]", users_repo: UserRepository) -> User:
-        # request.user does not have a session attached, so we need to fetch the user from the database
-        return users_repo.get(request.user.id)
+    async def get_my_user(
+        self, request: "Request[User, Token, Any]", users_repo: UserAsyncRepository
+    ) -> Response[User]:
+        """Responds with an ETag, and with a 304 when `If-None-Match` has the current one (see `app.conditional`)."""
+        tag = etag(*await users_repo.get_versions(request.user.id))
+        check_not_modified(request, tag)
+        # request.user is loaded without its relationships, so we need to fetch the user again with them
+        return Response(await users_repo.get(request.user.id), headers={"ETag": tag})
+
+    @post(
+        "/me/settle",
+        dependencies={"expenses_repo": Provide(provide_expense_repository)},
+        status_code=HTTP_200_OK,
+    )
+    async def settle(
+        self,
+        request: "Request[User, Token, Any]",
+        expenses_repo: ExpenseAsyncRepository,
+        creditor_id: Optional[int] = None,
+    ) -> dict[str, Any]:
+        """Pay all the open debts of the current user, or only those owed to `creditor_id`."""
+        return await expenses_repo.settle(request.user.id, creditor_id)
 
     @get("/{user_id:int}")
-    async def get_user(self, user_id: int, users_repo: UserRepository) -> dict[str, object]:
-        try:
-            debts = users_repo.get_user_debts(user_id)
-            expenses = users_repo.get_user_expenses(user_id, 'PENDING')
-
-            response = {
-            "user_id": user_id,
-            "debts": [
-                {
-                    "id": debt.expense_id,
-                    "amount": debt.amount,
-                    "paid_on": debt.paid_on.strftime('%Y-%m-%d %H:%M:%S') if debt.paid_on else None
-                }
-                for debt in debts
-            ],
-            "expenses": [
-                {
-                    "id": expense.id,
-                    "amount": expense.amount,
-                    "status": expense.status
-                }
-                for expense in expenses
-            ]
-            }
+    async def get_user(
+        self,
+        request: "Request[User, Token, Any]",
+        user_id: int,
+        users_repo: UserAsyncRepository,
+        limit: Annotated[int, Parameter(ge=1)] = settings.default_page_size,
+    ) -> dict[str, object]:
+        """Totals of the pending debts and expenses of the user, and the `limit` most recent of each, cached until
+        they change (see `app.response_cache`)."""
 
-            return response 
-            
+        async def load() -> dict[str, object]:
+            return await users_repo.get_user_summary(user_id, page_size(limit))
+
+        try:
+            return await response_cache.get_or_set(f"users:{user_id}", request, load)
         except NotFoundError:
             raise HTTPException(detail="User not found", status_code=404)
+
     @get("/{user_id:int}/expenses")
-    async def get_user_expenses(self, user_id: int, users_repo: UserRepository) -> list[dict[str, Any]]:
+    async def get_user_expenses(self, user_id: int, users_repo: UserAsyncRepository) -> list[ExpenseRecord]:
         try:
-            expenses = users_repo.get_user_expenses(user_id)
-            return [expense.to_dict() for expense in expenses] 
+            return await users_repo.get_user_expenses(user_id)
         except NotFoundError:
             raise HTTPException(detail="Expenses not found", status_code=404)
 
     @get("/{user_id:int}/debts")
-    async def get_user_debts(self, user_id: int, users_repo: UserRepository) -> list[dict[str, Any]]:
+    async def get_user_debts(
+        self, request: "Request[User, Token, Any]", user_id: int, users_repo: UserAsyncRepository
+    ) -> list[DebtRow]:
+        """All the debts of the user, cached until they change (see `app.response_cache`)."""
         try:
-            debts = users_repo.get_user_all_debts(user_id)
-            return [debt.to_dict() for debt in debts] 
+            return await response_cache.get_or_set(
+                f"users:{user_id}", request, lambda: users_repo.get_user_all_debts(user_id)
+            )
         except NotFoundError:
             raise HTTPException(detail="Debts not found", status_code=404)
 
+    @get("/{user_id:int}/expenses/export")
+    async def export_user_expenses(
+        self, user_id: int, users_repo: UserAsyncRepository, format: ExportFormat = "ndjson"
+    ) -> Stream:
+        """All the expenses created by the user, streamed as NDJSON or CSV."""
+        await users_repo.get_user_by_id(user_id)
+        return export(expenses_statement(user_id), format, f"user-{user_id}-expenses")
+
+    @get("/{user_id:int}/debts/export")
+    async def export_user_debts(
+        self, user_id: int, users_repo: UserAsyncRepository, format: ExportFormat = "ndjson"
+    ) -> Stream:
+        """All the debts of the user, paid or not, streamed as NDJSON or CSV."""
+        await users_repo.get_user_by_id(user_id)
+        return export(debts_statement(user_id), format, f"user-{user_id}-debts")
+
+    @get("/{user_id:int}/balance")
+    async def get_user_balance(self, user_id: int, users_repo: UserAsyncRepository) -> dict[str, Any]:
+        return await users_repo.get_balance(user_id)
 
     @patch("/{user_id:int}", dto=UserUpdateDTO)
-    async def update_user(self, user_id: int, data: DTOData[User], users_repo: UserRepository) -> User:
+    async def update_user(self, user_id: int, data: DTOData[User], users_repo: UserAsyncRepository) -> User:
         try:
-            user, _ = users_repo.get_and_update(id=user_id, **data.as_builtins(), match_fields=["id"])
-            return user
+            return await users_repo.get_and_update(user_id, **data.as_builtins())
         except NotFoundError:
             raise HTTPException(detail="User not found", status_code=404)
 
     @delete("/{user_id:int}")
-    async def delete_user(self, user_id: int, users_repo: UserRepository) -> None:
+    async def delete_user(self, user_id: int, users_repo: UserAsyncRepository) -> None:
         try:
-            users_repo.delete_user(user_id)
+            await users_repo.delete_user(user_id)
         except NotFoundError:
             raise HTTPException(detail="User not found", status_code=404)
 
@@ -110,18 +178,13 @@ class UserController(Controller):
     async def change_password(
         self,
         request: "Request[User, Token, Any]",
-        users_repo: UserRepository, 
+        users_repo: UserAsyncRepository, 
         data: ChangePasswordRequest,
     ) -> dict[str, Collection[str]]:
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            raise HTTPException(detail="Token de autenticación faltante o inválido", status_code=401)
-        token = auth_header.split(" ")[1]
-
-        user = users_repo.retrieve_user_from_token(token)
+        user = await users_repo.get_user_by_id(request.user.id)
 
-        # Verificar la contraseña actua
-        if data.current_password != user.password:
+        # Verificar la contraseña actual
+        if not await users_repo.verify_password(user, data.current_password):
             raise HTTPException(detail="Contraseña actual incorrecta", status_code=401)
 
         # if data.new_password in user.last_passwords[-3:]:
@@ -131,16 +194,14 @@ class UserController(Controller):
         #     raise HTTPException(detail="La nueva contraseña no puede ser igual a las últimas 3 contraseñas utilizadas", status_code=400)
 
         # Hash de la nueva contraseña
-        # hashed_new_password = password_hasher.hash(data.new_password)
+        hashed_new_password = await users_repo.hash_password(data.new_password)
         try:
-            # users_repo.update_password(user, hashed_new_password)
-            users_repo.update_password(user, data.new_password)
+            await users_repo.update_password(user, hashed_new_password)
 
             # user.last_passwords.append(user.password)  # Agregar la antigua contraseña a la lista
             # if len(user.last_passwords) > 3:
             #     user.last_passwords.pop(0)  # Mantener solo las últimas 3 contraseñas
 
-            users_repo.update(user)
             user_data = {
                 "message": "Contraseña actualizada correctamente",
                 "user_info":{
@@ -169,16 +230,19 @@ class AuthController(Controller):
     async def login(
         self,
         data: Annotated[Login, Body(media_type=RequestEncodingType.URL_ENCODED)],
-        users_repo: UserRepository,
+        users_repo: UserAsyncRepository,
     ) -> Response[Any]:
-            user = users_repo.get_one_or_none(username=data.username)
+            user = await users_repo.get_one_or_none(username=data.username)
 
-            if not user or not data.password == user.password:
+            if not user or not await users_repo.verify_password(user, data.password):
                 raise HTTPException(detail="Invalid username or password", status_code=401)
+            if not user.is_active:
+                raise HTTPException(detail="Usuario desactivado", status_code=403)
 
-            users_repo.update_last_login(user)
+            # written in the background, see `app.services.accounts.last_login`
+            last_login_buffer.record(user.id)
             
-            token, expiration_minutes = users_repo.create_token(user)
+            token, _ = token_service.create(user)
 
             user_data = {
                 "id": user.id,
@@ -190,7 +254,7 @@ class AuthController(Controller):
             return Response(
                 content={
                 "access_token": token,
-                "expires_at": f"{expiration_minutes} minutes",
+                "expires_at": f"{settings.token_expiration_minutes} minutes",
                 "user": user_data
             },
                 status_code=200,
@@ -199,7 +263,11 @@ class AuthController(Controller):
 
 
     @post("/logout")
-    async def logout(self) -> Response[None]:
+    async def logout(self, request: Request[Any, Any, Any]) -> Response[None]:
+        # /accounts/auth is excluded from authentication, so the token is read here
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            token_service.revoke(authorization.removeprefix("Bearer "))
         response = Response(content=None, status_code=HTTP_200_OK)
         response.delete_cookie("token")
 
@@ -1,8 +1,15 @@
 from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, TypeAlias
+
+import msgspec
 
 from advanced_alchemy.extensions.litestar import SQLAlchemyDTO, SQLAlchemyDTOConfig
 from litestar.dto import DataclassDTO
 from pydantic import BaseModel, Field
+from app.serialization import row_struct
+from app.services.expenses.models import Debt, Expense
+
 from .models import User
 
 
@@ -48,3 +55,27 @@ class DebtDTO(BaseModel):
     amount: float
     paid_on: str
 
+
+# Rows encoded straight from query results, see `app.serialization`
+# (the row `version` only goes in ETags, see `app.conditional`)
+USER_ROW_COLUMNS = [column for column in User.__table__.columns if column.key not in {"password", "version"}]
+# fields a client can pick with `?fields=`
+USER_FIELDS = [str(column.key) for column in USER_ROW_COLUMNS]
+PENDING_DEBT_ROW_COLUMNS = [Debt.expense_id.label("id"), Debt.amount, Debt.paid_on]
+PENDING_EXPENSE_ROW_COLUMNS = [Expense.id, Expense.amount, Expense.status]
+if TYPE_CHECKING:
+    UserRow: TypeAlias = msgspec.Struct
+    PendingDebtRow: TypeAlias = msgspec.Struct
+    PendingExpenseRow: TypeAlias = msgspec.Struct
+else:
+    UserRow = row_struct("UserRow", USER_ROW_COLUMNS)
+    PendingDebtRow = row_struct("PendingDebtRow", PENDING_DEBT_ROW_COLUMNS)
+    PendingExpenseRow = row_struct("PendingExpenseRow", PENDING_EXPENSE_ROW_COLUMNS)
+
+
+@lru_cache
+def user_struct(fields: tuple[str, ...]) -> type[msgspec.Struct]:
+    """`UserRow` trimmed to `fields` (as returned by `app.serialization.requested_fields`)."""
+    if list(fields) == USER_FIELDS:
+        return UserRow
+    return row_struct("UserRow", [column for column in USER_ROW_COLUMNS if column.key in fields])
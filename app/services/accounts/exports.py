@@ -0,0 +1,16 @@
+"""Exports of a user's history, streamed with `app.streaming.export`."""
+
+from typing import Any
+
+from sqlalchemy import Select, select
+
+from app.services.expenses.dtos import DEBT_ROW_COLUMNS, EXPENSE_RECORD_COLUMNS
+from app.services.expenses.models import Debt, Expense
+
+
+def expenses_statement(user_id: int) -> Select[Any]:
+    return select(*EXPENSE_RECORD_COLUMNS).where(Expense.created_by_id == user_id).order_by(Expense.id)
+
+
+def debts_statement(user_id: int) -> Select[Any]:
+    return select(*DEBT_ROW_COLUMNS).where(Debt.user_id == user_id).order_by(Debt.expense_id)
@@ -0,0 +1,87 @@
+import asyncio
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, ParamSpec, TypeVar
+
+from litestar.exceptions import ServiceUnavailableException
+from pwdlib import PasswordHash
+from pwdlib.exceptions import UnknownHashError
+
+from app.config import settings
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+password_hasher = PasswordHash.recommended()
+
+
+class HashingPool:
+    """Dedicated thread pool for password hashing, so argon2 never runs on the event loop.
+
+    argon2 releases the GIL while hashing, so threads use all the cores without the cost of a process pool. At most
+    `workers + queue_size` operations are accepted at once; beyond that they are rejected with a 503 instead of
+    queueing without bound (each hash also takes 64 MiB of memory with the default parameters).
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, function: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ServiceUnavailableException(
+                detail="Servicio saturado, intente nuevamente", headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hashing")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict[str, int]:
+        return {"workers": self.workers, "in_flight": self.in_flight, "rejected": self.rejected}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(workers=settings.hashing_workers, queue_size=settings.hashing_queue_size)
+
+
+def verify_and_update(password: str, stored: str) -> tuple[bool, Optional[str]]:
+    """Check `password` against the stored hash, returning a new hash too if the stored one is outdated."""
+    try:
+        return password_hasher.verify_and_update(password, stored)
+    except UnknownHashError:
+        # passwords saved before they were hashed are stored as plaintext
+        if hmac.compare_digest(password.encode(), stored.encode()):
+            return True, password_hasher.hash(password)
+        return False, None
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(password_hasher.hash, password)
+
+
+async def verify_password(password: str, stored: str) -> tuple[bool, Optional[str]]:
+    return await hashing_pool.run(verify_and_update, password, stored)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from litestar import Litestar
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import on_commit, run_in_new_session
+from app.response_cache import response_cache
+
+from .cache import principal_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginBuffer:
+    """Login timestamps kept in memory and written in batches, off the login path.
+
+    A background task (see `lifespan`) writes them with a single executemany UPDATE every `interval` seconds, or as
+    soon as `max_size` users are pending, and once more on shutdown. Only the latest login of each user is kept.
+    """
+
+    def __init__(self, interval: float, max_size: int) -> None:
+        self.interval = interval
+        self.max_size = max_size
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self._pending: dict[int, datetime] = {}
+        # set when the buffer fills up; created by `lifespan`, in the loop of the app
+        self._full: Optional[asyncio.Event] = None
+
+    def record(self, user_id: int) -> None:
+        # naive UTC, like the `last_login` column
+        self._pending[user_id] = datetime.now(timezone.utc).replace(tzinfo=None)
+        if len(self._pending) >= self.max_size and self._full is not None:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """Write the pending logins, returning how many; they are kept for the next flush if the write fails."""
+        if self._full is not None:
+            self._full.clear()
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [{"id": user_id, "last_login": last_login} for user_id, last_login in pending.items()]
+
+        def invalidate() -> None:
+            for user_id in pending:
+                principal_cache.invalidate(user_id)
+
+        def write(session: Session) -> None:
+            session.execute(update(User), rows)
+            # cached principals and responses show `last_login` too; users are also the creators of listed expenses
+            on_commit(session, invalidate)
+            response_cache.invalidate_on_commit(session, "expenses", *(f"users:{user_id}" for user_id in pending))
+
+        try:
+            await run_in_new_session(write)
+        except Exception:
+            self.failures += 1
+            # logins recorded in the meantime are newer
+            self._pending = pending | self._pending
+            raise
+        self.flushes += 1
+        self.written += len(rows)
+        return len(rows)
+
+    async def run(self, full: asyncio.Event) -> None:
+        while True:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(full.wait(), self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not write %d last logins", len(self._pending))
+
+    @asynccontextmanager
+    async def lifespan(self, app: Litestar) -> AsyncIterator[None]:
+        self._full = asyncio.Event()
+        task = asyncio.create_task(self.run(self._full))
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            self._full = None
+            await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "depth": len(self._pending),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+        }
+
+
+last_login_buffer = LastLoginBuffer(
+    interval=settings.last_login_flush_interval, max_size=settings.last_login_buffer_size
+)
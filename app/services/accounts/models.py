@@ -2,7 +2,7 @@ from typing import TYPE_CHECKING, Optional
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
-from app.database import Base
+from app.database import Base, version_column
 
 if TYPE_CHECKING:
     from app.services.expenses.models import Debt, Expense
@@ -18,6 +18,7 @@ class User(Base):
     password: Mapped[str]
     is_active: Mapped[bool] = mapped_column(default=True)
     last_login: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    version: Mapped[int] = version_column("accounts_users")
     created_expenses: Mapped[list["Expense"]] = relationship(back_populates="created_by")
     debts: Mapped[list["Debt"]] = relationship(back_populates="user")
 
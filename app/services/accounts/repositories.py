@@ -1,41 +1,64 @@
+from advanced_alchemy.exceptions import NotFoundError
 from advanced_alchemy.repository import SQLAlchemySyncRepository
-from pwdlib import PasswordHash
-from sqlalchemy.orm import Session
-import jwt
-from datetime import datetime, timedelta 
+from sqlalchemy.orm import raiseload, selectinload
 from typing import Optional
 from sqlalchemy import select,null
 import sqlalchemy as sa
-from datetime import datetime 
+from app.pagination import keyset
+from app.response_cache import response_cache
+from .cache import principal_cache
+from .hashing import hash_password, verify_password
 from .models import User
-from app.services.expenses.models import Debt
-from app.services.expenses.models import Expense
-from litestar import Controller, Request, Response
+from .tokens import token_service
+from app.conditional import versions
+from app.database import AsyncRepository, DatabaseSession, on_commit
+from app.services.expenses.models import Debt, PairBalance, UserBalance
+from app.services.expenses.dtos import DEBT_ROW_COLUMNS, EXPENSE_RECORD_COLUMNS, DebtRow, ExpenseRecord
+from app.services.expenses.models import Expense, ExpenseStatus
+from .dtos import (
+    USER_FIELDS,
+    USER_ROW_COLUMNS,
+    PendingDebtRow,
+    PendingExpenseRow,
+    UserRow,
+    user_struct,
+)
+from litestar import Response
 from litestar.exceptions import HTTPException
-from typing import Any, List
-from sqlalchemy.orm import Query
-password_hasher = PasswordHash.recommended()
+from typing import Any, List, Sequence
+
+# Loader profiles, see `app.services.expenses.repositories`
+# users updated through the API serialize no relationships at all
+USER_LIST_LOAD = [raiseload("*")]
+# the current user with its created expenses and debts, one `IN` query for each
+USER_DETAIL_LOAD = [selectinload(User.created_expenses), selectinload(User.debts), raiseload("*")]
 
 
 class UserRepository(SQLAlchemySyncRepository[User]):
     model_type = User
 
-    def add_with_password_hash(self, user: User) -> User:
-        """Creates a new user hashing the password."""
-        password_hasher.hash(user.password)
+    def add_with_password_hash(self, user: User, password_hash: str) -> User:
+        """Creates a new user with `password_hash`, computed in the hashing pool (see `UserAsyncRepository`)."""
+        user.password = password_hash
         return self.add(user)
 
-    def update_last_login(self, user: User) -> None:
-        """Updates the last_login field of an existing user."""
-        user.last_login = datetime.utcnow()  
-        self.update(user) 
-        self.session.commit() 
-
     def update_password(self, user: User, new_password: str) -> None:
-        """Hashes and updates the user's password."""
+        """Updates the user's password, `new_password` must be already hashed."""
         user.password = new_password
         self.update(user)
-        self.session.commit()
+        on_commit(self.session, lambda: principal_cache.invalidate(user.id))
+
+    def update_user(self, user_id: int, **values: Any) -> User:
+        """`get_and_update` by id, dropping the cached principal once committed."""
+        user, _ = self.get_and_update(
+            id=user_id, **values, match_fields=["id"], load=USER_LIST_LOAD, auto_refresh=False
+        )
+        on_commit(self.session, lambda: principal_cache.invalidate(user_id))
+        # users are shown as the creators of the listed expenses
+        response_cache.invalidate_on_commit(self.session, "expenses")
+        if values.get("is_active") is False:
+            on_commit(self.session, lambda: token_service.revoke_user(user_id))
+        return user
 
     def get_one_or_none(self, username: str) -> Optional[User]: # type: ignore[override]
         """Retrieve one user by username or return None if not found."""
@@ -49,36 +72,6 @@ class UserRepository(SQLAlchemySyncRepository[User]):
         return user
 
 
-    def retrieve_user_from_token(self, token: str) -> User:
-        payload = jwt.decode(token, "secret", algorithms=["HS256"])
-
-        user_id = payload.get("user_id")
-
-        if not user_id:
-            raise HTTPException(detail="Token invalido.", status_code=403)
-        user = self.get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(detail="Usuario no encontrado.", status_code=404)
-        
-        return user
-
-    def create_token(self,user:User) -> tuple[str, float]:
-        secret_key = "secret"
-        expiration_time = datetime.utcnow() + timedelta(minutes=180)
-        payload = {
-            'user_id': user.id,
-            'name': user.full_name,
-            'email': user.email,
-            "iat": datetime.utcnow(),
-            'exp': expiration_time,
-            'sub': str(user.username),
-            'is_active': user.is_active
-        }
-        token = jwt.encode(payload, secret_key, algorithm='HS256')
-
-        expiration_minutes = (expiration_time - datetime.utcnow()).total_seconds() // 60
-        return token, expiration_minutes
-
     def delete_user(self, user_id: int) -> Response[Any]:
         user = self.session.query(User).filter(User.id == user_id).first()
         
@@ -87,34 +80,216 @@ class UserRepository(SQLAlchemySyncRepository[User]):
         
         user.is_active = False
         self.session.add(user) 
-        self.session.commit() 
+        self.session.flush()
+        on_commit(self.session, lambda: principal_cache.invalidate(user.id))
+        on_commit(self.session, lambda: token_service.revoke_user(user.id))
+        response_cache.invalidate_on_commit(self.session, "expenses")
         return Response(
                 content={"message": "El usuario ha sido desactivado con exito"},
                 status_code=200,
                 media_type="application/json"
                 )
 
-    def get_user_expenses(self, user_id: int, status: Optional[str] = None) -> Query[Expense]:
-        query = self.session.query(Expense).filter(Expense.created_by_id == user_id)
+    def get_user_expenses(self, user_id: int, status: Optional[ExpenseStatus] = None) -> list[ExpenseRecord]:
+        statement = select(*EXPENSE_RECORD_COLUMNS).where(Expense.created_by_id == user_id)
         
         if status:
-            query = query.filter(Expense.status == status)
+            statement = statement.where(Expense.status == status)
         
-        return query
+        return [ExpenseRecord(*row) for row in self.session.execute(statement.order_by(Expense.id))]
+
+    def get_user_summary(self, user_id: int, limit: int) -> dict[str, Any]:
+        """Count and amount of the user's pending debts, of what is owed to it and of its pending expenses, with the
+        `limit` most recent pending debts and expenses, in a single statement. Deleted expenses and their debts are left
+        out, as in the balance.
+
+        Each branch of the UNION ALL is a `(kind, number, amount)` row: the user (missing if it doesn't exist), a
+        total aggregated in the database, or a recent item read through the `user_id`/`created_by_id` indexes.
+        """
+        active = Expense.is_deleted.is_(False)
+        pending_debts = (Debt.user_id == user_id, Debt.paid_on.is_(null()), active)
+        owed_debts = (Expense.created_by_id == user_id, Debt.paid_on.is_(null()), active)
+        pending_expenses = (Expense.created_by_id == user_id, Expense.status == ExpenseStatus.PENDING, active)
+        recent_debts = (
+            select(Debt.expense_id, Debt.amount)
+            .join_from(Debt, Expense)
+            .where(*pending_debts)
+            .order_by(Debt.expense_id.desc())
+            .limit(limit)
+            .subquery()
+        )
+        recent_expenses = (
+            select(Expense.id, Expense.amount)
+            .where(*pending_expenses)
+            .order_by(Expense.id.desc())
+            .limit(limit)
+            .subquery()
+        )
+
+        def total(kind: str, amount: Any) -> sa.Select[Any]:
+            return select(sa.literal(kind), sa.func.count(), sa.func.coalesce(sa.func.sum(amount), 0))
+
+        statement = sa.union_all(
+            select(sa.literal("user"), User.id, sa.literal(0)).where(User.id == user_id),
+            total("owes", Debt.amount).join_from(Debt, Expense).where(*pending_debts),
+            total("owed", Debt.amount).join_from(Debt, Expense).where(*owed_debts),
+            total("pending_expenses", Expense.amount).where(*pending_expenses),
+            select(sa.literal("debt"), recent_debts.c.expense_id, recent_debts.c.amount),
+            select(sa.literal("expense"), recent_expenses.c.id, recent_expenses.c.amount),
+        )
+
+        found = False
+        summary: dict[str, dict[str, int]] = {}
+        debts: list[tuple[int, int]] = []
+        expenses: list[tuple[int, int]] = []
+        for kind, number, amount in self.session.execute(statement):
+            if kind == "user":
+                found = True
+            elif kind == "debt":
+                debts.append((number, amount))
+            elif kind == "expense":
+                expenses.append((number, amount))
+            else:
+                summary[kind] = {"count": number, "amount": amount}
+        if not found:
+            raise NotFoundError(f"No user found with id {user_id}")
+        # a UNION ALL doesn't keep the order of its branches
+        return {
+            "user_id": user_id,
+            "summary": summary,
+            "debts": [PendingDebtRow(*debt, None) for debt in sorted(debts, reverse=True)],
+            "expenses": [
+                PendingExpenseRow(*expense, ExpenseStatus.PENDING) for expense in sorted(expenses, reverse=True)
+            ],
+        }
+
+
+    def get_user_all_debts(self, user_id: int) -> list[DebtRow]:
+        statement = select(*DEBT_ROW_COLUMNS).where(Debt.user_id == user_id).order_by(Debt.expense_id)
+        return [DebtRow(*row) for row in self.session.execute(statement)]
+
+    def get_balance(self, user_id: int) -> dict[str, Any]:
+        """What the user owes and is owed in unpaid debts, in total and by counterpart, read from the ledger."""
+        self.get_user_by_id(user_id)
+        balance = self.session.get(UserBalance, user_id)
+        owes, owed = (balance.owes, balance.owed) if balance else (0, 0)
+        owes_to = self.session.execute(
+            select(PairBalance.creditor_id, PairBalance.amount)
+            .where(PairBalance.debtor_id == user_id, PairBalance.amount != 0)
+            .order_by(PairBalance.creditor_id)
+        )
+        owed_by = self.session.execute(
+            select(PairBalance.debtor_id, PairBalance.amount)
+            .where(PairBalance.creditor_id == user_id, PairBalance.amount != 0)
+            .order_by(PairBalance.debtor_id)
+        )
+        return {
+            "user_id": user_id,
+            "owes": owes,
+            "owed": owed,
+            "net": owed - owes,
+            "owes_to": [{"user_id": creditor_id, "amount": amount} for creditor_id, amount in owes_to],
+            "owed_by": [{"user_id": debtor_id, "amount": amount} for debtor_id, amount in owed_by],
+        }
+
+    def get_versions(self, user_id: int) -> tuple[int, ...]:
+        """Versions of the user, its created expenses and its debts (see `app.conditional`)."""
+        row = self.session.execute(
+            select(
+                User.version,
+                *versions(Expense, Expense.created_by_id == User.id),
+                *versions(Debt, Debt.user_id == User.id),
+            ).where(User.id == user_id)
+        ).one_or_none()
+        if row is None:
+            raise NotFoundError(f"No user found with id {user_id}")
+        return tuple(row)
+
+    def list(  # type: ignore[override]
+        self,
+        *,
+        cursor: Optional[int],
+        limit: int,
+        is_active: Optional[bool] = None,
+        fields: Sequence[str] = USER_FIELDS,
+    ) -> List[UserRow]:
+        """Page of users after `cursor` (see `app.pagination.keyset`), with only the requested `fields`."""
+        struct = user_struct(tuple(fields))
+        statement = select(*(column for column in USER_ROW_COLUMNS if column.key in fields))
+        if is_active is not None:
+            statement = statement.where(User.is_active == is_active)
+        return [struct(*row) for row in self.session.execute(keyset(statement, User.id, cursor, limit))]
+
+
+class UserAsyncRepository(AsyncRepository[UserRepository]):
+    """Awaitable version of `UserRepository`, used by the controllers."""
+
+    repository_type = UserRepository
+
+    async def list(self, **filters: Any) -> list[UserRow]:
+        return await self.run(lambda repo: repo.list(**filters))
+
+    async def get(self, user_id: int) -> User:
+        """Retrieve a user with its expenses and debts loaded, ready to be serialized."""
+        return await self.run(lambda repo: repo.get(user_id, load=USER_DETAIL_LOAD))
+
+    async def get_versions(self, user_id: int) -> tuple[int, ...]:
+        return await self.run(UserRepository.get_versions, user_id)
+
+    async def get_one(self, username: str) -> User:
+        return await self.run(lambda repo: repo.get_one(username=username))
+
+    async def get_user_by_id(self, user_id: int) -> User:
+        return await self.run(UserRepository.get_user_by_id, user_id)
+
+    async def get_one_or_none(self, username: str) -> Optional[User]:
+        return await self.run(UserRepository.get_one_or_none, username)
+
+    async def add_with_password_hash(self, user: User) -> User:
+        password_hash = await self.hash_password(user.password)
+        return await self.run(UserRepository.add_with_password_hash, user, password_hash)
+
+    async def hash_password(self, password: str) -> str:
+        """Hash a password in the hashing pool (see `app.services.accounts.hashing`)."""
+        return await hash_password(password)
+
+    async def verify_password(self, user: User, password: str) -> bool:
+        """Check the user's password in the hashing pool.
+
+        If the stored password is plaintext or was hashed with outdated parameters, it's replaced with a new hash,
+        saved with the next commit.
+        """
+        valid, updated = await verify_password(password, user.password)
+        if updated is not None:
+            user.password = updated
+        return valid
+
+    async def update(self, user: User) -> User:
+        return await self.run(lambda repo: repo.update(user))
+
+    async def get_and_update(self, user_id: int, **values: Any) -> User:
+        return await self.run(lambda repo: repo.update_user(user_id, **values))
+
+    async def update_password(self, user: User, new_password: str) -> None:
+        await self.run(UserRepository.update_password, user, new_password)
+
+    async def delete_user(self, user_id: int) -> None:
+        await self.run(UserRepository.delete_user, user_id)
 
-    def get_user_debts(self, user_id: int) ->list[Debt]:
-        debts = self.session.query(Debt).filter(
-            Debt.user_id == user_id,
-            Debt.paid_on.is_(null())
-        ).all()
+    async def get_user_expenses(
+        self, user_id: int, status: Optional[ExpenseStatus] = None
+    ) -> List[ExpenseRecord]:
+        return await self.run(UserRepository.get_user_expenses, user_id, status)
 
-        return debts
+    async def get_user_summary(self, user_id: int, limit: int) -> dict[str, Any]:
+        return await self.run(UserRepository.get_user_summary, user_id, limit)
 
+    async def get_user_all_debts(self, user_id: int) -> List[DebtRow]:
+        return await self.run(UserRepository.get_user_all_debts, user_id)
 
-    def get_user_all_debts(self, user_id: int)-> list[Debt]:
-        debts = self.session.query(Debt).filter(Debt.user_id == user_id).all()
-        return debts
+    async def get_balance(self, user_id: int) -> dict[str, Any]:
+        return await self.run(UserRepository.get_balance, user_id)
 
 
-async def provide_user_repository(db_session: Session) -> UserRepository:
-    return UserRepository(session=db_session)
+async def provide_user_repository(db_session: DatabaseSession) -> UserAsyncRepository:
+    return UserAsyncRepository(session=db_session)
@@ -2,27 +2,45 @@ from typing import Any
 
 from advanced_alchemy.exceptions import NotFoundError
 from litestar.connection import ASGIConnection
-from litestar.exceptions import NotFoundException
+from litestar.exceptions import NotAuthorizedException, NotFoundException
 from litestar.security.jwt import OAuth2PasswordBearerAuth, Token
 
 from app.config import settings
 from app.database import sqlalchemy_config
 
+from .cache import principal_cache
 from .models import User
-from .repositories import UserRepository
+from .repositories import UserAsyncRepository
+from .tokens import ALGORITHM, VerifiedToken
 
 
 async def retrieve_user_handler(
     token: "Token",
-    _: "ASGIConnection[Any, Any, Any, Any]",
+    connection: "ASGIConnection[Any, Any, Any, Any]",
 ) -> User:
-    """Retrieve user from the database using the token."""
-    session_maker = sqlalchemy_config.create_session_maker()
-    try:
-        with session_maker() as session:
-            return UserRepository(session=session).get_one(username=token.sub)
-    except NotFoundError as e:
-        raise NotFoundException("User not found") from e
+    """Build the user from the token claims, or retrieve it from the principal cache or the database.
+
+    Tokens issued by `token_service` carry the user id and whether it is active, so they are authorized without
+    touching the database; deactivating a user revokes its tokens (see `TokenService.revoke_user`). The lookup is only
+    for tokens without those claims. It uses the request's session (the same one injected later as `db_session`), so
+    authenticating doesn't check out a second connection from the pool; the plugin closes it when the response is sent.
+    """
+    user_id = token.extras.get("user_id")
+    if user_id is not None:
+        if not token.extras.get("is_active", True):
+            raise NotAuthorizedException("Usuario desactivado")
+        return User(id=user_id, username=token.sub, is_active=True)
+    user = principal_cache.get(token.sub)
+    if user is None:
+        session = sqlalchemy_config.provide_session(connection.app.state, connection.scope)
+        try:
+            user = await UserAsyncRepository(session=session).get_one(username=token.sub)
+        except NotFoundError as e:
+            raise NotFoundException("User not found") from e
+        principal_cache.set(user)
+    if not user.is_active:
+        raise NotAuthorizedException("Usuario desactivado")
+    return user
 
 # async def get_current_user(token: Token, _: ASGIConnection[Any, Any, Any, Any]) -> User:
 #     """Obtener el usuario actual utilizando el token JWT."""
@@ -40,5 +58,7 @@ oauth2_auth = OAuth2PasswordBearerAuth[User](
     retrieve_user_handler=retrieve_user_handler,
     token_secret=settings.secret_key.get_secret_value(),
     token_url="/accounts/auth/login",
-    exclude=["/accounts/auth", "/schema","/accounts/auth/login"],
+    token_cls=VerifiedToken,
+    algorithm=ALGORITHM,
+    exclude=["/accounts/auth", "/schema","/accounts/auth/login", *(["/metrics"] if settings.metrics_public else [])],
 )
@@ -0,0 +1,149 @@
+import heapq
+import threading
+import uuid
+from collections import OrderedDict
+from collections.abc import Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import jwt
+from litestar.exceptions import NotAuthorizedException
+from litestar.security.jwt import Token
+from typing_extensions import Self
+
+from app.config import settings
+
+from .models import User
+
+ALGORITHM = "HS256"
+
+
+class TokenService:
+    """Issues and verifies the access tokens.
+
+    Tokens carry everything needed to authorize a request (`sub` is the username, `user_id` the id, `is_active` its
+    status), so verifying one needs no database query. Verified tokens are memoized in a bounded LRU cache, so each
+    signature is checked once. Revocations, of a single token (logout) or of every token issued to a user until now
+    (deactivation), are kept in memory and checked with a dict lookup; like the principal cache, each worker has its
+    own. Tokens also carry `issued_at`, the issue time with sub-second precision (`iat` is in whole seconds), so one
+    issued right after its user's tokens were revoked isn't revoked too.
+    """
+
+    def __init__(self, secret: str, expiration: timedelta, cache_size: int) -> None:
+        self.secret = secret
+        self.expiration = expiration
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._verified: OrderedDict[str, Token] = OrderedDict()
+        # revoked token id (or the token itself if it has none) -> its expiration, plus a heap to forget expired ones
+        self._revoked_tokens: dict[str, datetime] = {}
+        self._expirations: list[tuple[datetime, str]] = []
+        # user id -> tokens issued up to this timestamp are revoked
+        self._revoked_users: dict[int, float] = {}
+        # revocations may come from worker threads (see `app.database.on_commit`)
+        self._lock = threading.Lock()
+
+    def create(self, user: User) -> tuple[str, datetime]:
+        """Issue a token for the user, returning it with its expiration."""
+        now = datetime.now(timezone.utc)
+        expires_at = now + self.expiration
+        payload = {
+            "sub": user.username,
+            "user_id": user.id,
+            "is_active": user.is_active,
+            "iat": now,
+            "exp": expires_at,
+            "jti": uuid.uuid4().hex,
+            "issued_at": now.timestamp(),
+        }
+        return jwt.encode(payload, self.secret, algorithm=ALGORITHM), expires_at
+
+    def verify(self, encoded_token: str) -> Token:
+        """Decode a token, raising `NotAuthorizedException` if it's invalid, expired or revoked."""
+        with self._lock:
+            token = self._verified.get(encoded_token)
+            if token is not None:
+                self._verified.move_to_end(encoded_token)
+                self.hits += 1
+        if token is None:
+            self.misses += 1
+            token = Token.decode(encoded_token, secret=self.secret, algorithm=ALGORITHM)
+            with self._lock:
+                self._verified[encoded_token] = token
+                if len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        elif token.exp <= datetime.now(timezone.utc):
+            raise NotAuthorizedException("Token expirado")
+        if self.is_revoked(token, encoded_token):
+            raise NotAuthorizedException("Token revocado")
+        return token
+
+    def is_revoked(self, token: Token, encoded_token: str) -> bool:
+        if (token.jti or encoded_token) in self._revoked_tokens:
+            return True
+        revoked_at = self._revoked_users.get(token.extras.get("user_id", -1))
+        if revoked_at is None:
+            return False
+        return float(token.extras.get("issued_at", token.iat.timestamp())) <= revoked_at
+
+    def revoke(self, encoded_token: str) -> None:
+        """Revoke a single token, e.g. on logout.
+
+        Tokens that are already invalid, expired or revoked are ignored, so revoking is idempotent.
+        """
+        try:
+            token = self.verify(encoded_token)
+        except NotAuthorizedException:
+            return
+        key = token.jti or encoded_token
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._revoked_tokens[key] = token.exp
+            heapq.heappush(self._expirations, (token.exp, key))
+            # expired tokens are rejected anyway
+            while self._expirations and self._expirations[0][0] <= now:
+                _, expired = heapq.heappop(self._expirations)
+                self._revoked_tokens.pop(expired, None)
+            self._verified.pop(encoded_token, None)
+
+    def revoke_user(self, user_id: int) -> None:
+        """Revoke every token issued to the user so far, e.g. when it's deactivated."""
+        with self._lock:
+            self._revoked_users[user_id] = datetime.now(timezone.utc).timestamp()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._verified),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revoked_tokens": len(self._revoked_tokens),
+            "revoked_users": len(self._revoked_users),
+        }
+
+
+token_service = TokenService(
+    secret=settings.secret_key.get_secret_value(),
+    expiration=timedelta(minutes=settings.token_expiration_minutes),
+    cache_size=settings.token_cache_size,
+)
+
+
+class VerifiedToken(Token):
+    """Token class of the auth middleware, decoding through `token_service` instead of checking every signature."""
+
+    @classmethod
+    def decode(
+        cls,
+        encoded_token: str,
+        secret: str,
+        algorithm: str,
+        audience: Optional[str | Sequence[str]] = None,
+        issuer: Optional[str | Sequence[str]] = None,
+        require_claims: Optional[Sequence[str]] = None,
+        verify_exp: bool = True,
+        verify_nbf: bool = True,
+        strict_audience: bool = False,
+    ) -> Self:
+        token = token_service.verify(encoded_token)
+        return cls(**token.__dict__)
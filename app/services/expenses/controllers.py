@@ -1,17 +1,38 @@
-from typing import Any
+from operator import attrgetter
+from typing import Annotated, Any, Optional
 
 from advanced_alchemy.exceptions import NotFoundError
 from litestar import Controller, Request, Router, delete, get, patch, post, Response
 from litestar.di import Provide
 from litestar.dto import DTOData
 from litestar.exceptions import HTTPException
+from litestar.pagination import CursorPagination
+from litestar.params import Parameter
+from litestar.response import Stream
 from litestar.security.jwt import Token
 
+from app.conditional import check_not_modified, etag
+from app.config import settings
+from app.pagination import page_size, to_page
+from app.response_cache import response_cache
+from app.serialization import requested_datetime, requested_fields
+
 from app.services.accounts.models import User
+from app.streaming import ExportFormat, export
 
-from .dtos import ExpenseCreateDTO, ExpenseDTO, ExpenseUpdateDTO, ExpensesDTO
-from .models import Expense
-from .repositories import ExpenseRepository, provide_expense_repository
+from .imports import NDJSON_MEDIA_TYPES, import_expenses, json_rows, ndjson_rows
+from .dtos import (
+    EXPENSE_FIELDS,
+    EXPENSE_ROW_FIELDS,
+    ExpenseCreateDTO,
+    ExpenseDetail,
+    ExpenseDTO,
+    ExpenseRow,
+    ExpenseUpdateDTO,
+)
+from .models import Expense, ExpenseStatus
+from .reports import Report, report_statement
+from .repositories import ExpenseAsyncRepository, provide_expense_repository
 
 
 class ExpenseController(Controller):
@@ -22,53 +43,141 @@ class ExpenseController(Controller):
     return_dto = ExpenseDTO
     dependencies = {"expenses_repo": Provide(provide_expense_repository)}
 
-    @get(return_dto=ExpensesDTO)
-    async def list_expenses(self, expenses_repo: ExpenseRepository) -> list[Expense]:
-        return expenses_repo.list()
+    @get(return_dto=None)
+    async def list_expenses(
+        self,
+        request: "Request[User, Token, Any]",
+        expenses_repo: ExpenseAsyncRepository,
+        cursor: Optional[int] = None,
+        limit: Annotated[int, Parameter(ge=1)] = settings.default_page_size,
+        status: Optional[ExpenseStatus] = None,
+        created_by_id: Optional[int] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        min_amount: Optional[int] = None,
+        max_amount: Optional[int] = None,
+        fields: Optional[str] = None,
+    ) -> CursorPagination[int, ExpenseRow]:
+        """`fields` is a comma separated list of the fields to return (`id` is always included), e.g.
+        `?fields=title,amount,status`; the creator and the debts are only fetched when asked for.
+
+        Pages are cached until an expense changes (see `app.response_cache`).
+        """
+        limit = page_size(limit)
+        selected = requested_fields(fields, EXPENSE_ROW_FIELDS)
+        since, until = requested_datetime(date_from, "date_from"), requested_datetime(date_to, "date_to")
+
+        async def load() -> CursorPagination[int, ExpenseRow]:
+            expenses = await expenses_repo.list(
+                cursor=cursor,
+                limit=limit,
+                status=status,
+                created_by_id=created_by_id,
+                date_from=since,
+                date_to=until,
+                min_amount=min_amount,
+                max_amount=max_amount,
+                fields=selected,
+            )
+            return to_page(expenses, limit, attrgetter("id"))
+
+        return await response_cache.get_or_set("expenses", request, load)
 
     @post(dto=ExpenseCreateDTO)
     async def create_expense(
-        self, request: "Request[User, Token, Any]", expenses_repo: ExpenseRepository, data: Expense
+        self, request: "Request[User, Token, Any]", expenses_repo: ExpenseAsyncRepository, data: Expense
     ) -> Expense:
         if not request.user:
             raise HTTPException(detail="Usuario no autenticado", status_code=401)
-        return expenses_repo.create_with_debts(data, request.user)
+        return await expenses_repo.create_with_debts(data, request.user)
+
+    @post("/import")
+    async def import_expenses(
+        self,
+        request: "Request[User, Token, Any]",
+        expenses_repo: ExpenseAsyncRepository,
+        chunk_size: Annotated[int, Parameter(ge=1)] = settings.import_chunk_size,
+    ) -> dict[str, Any]:
+        """Create many expenses of the current user, from a JSON array or an NDJSON body (`application/x-ndjson`).
 
-    @get("/{expense_id:int}")
-    async def get_expense(self, expenses_repo: ExpenseRepository, expense_id: int) -> Expense:
+        Each row is validated like the body of `POST /expenses` and the amounts are split the same way.
+        """
+        media_type, _ = request.content_type
+        rows = ndjson_rows(request.stream()) if media_type in NDJSON_MEDIA_TYPES else json_rows(await request.body())
+        chunk_size = min(chunk_size, settings.max_import_chunk_size)
+        return await import_expenses(rows, expenses_repo, request.user.id, chunk_size)
+
+    @get("/{expense_id:int}", return_dto=None)
+    async def get_expense(
+        self,
+        request: "Request[User, Token, Any]",
+        expenses_repo: ExpenseAsyncRepository,
+        expense_id: int,
+        fields: Optional[str] = None,
+    ) -> Response[ExpenseDetail]:
+        """`fields` picks the fields to return, like in the list.
+
+        Responds with an ETag, and with a 304 when `If-None-Match` has the current one (see `app.conditional`).
+        """
+        selected = requested_fields(fields, EXPENSE_FIELDS)
         try:
-            return expenses_repo.get(expense_id)
+            tag = etag(selected, *await expenses_repo.get_versions(expense_id))
+            check_not_modified(request, tag)
+            return Response(await expenses_repo.get_row(expense_id, selected), headers={"ETag": tag})
         except NotFoundError:
             raise HTTPException(detail="Expense not found", status_code=404)
 
     @patch("/{expense_id:int}", dto=ExpenseUpdateDTO)
     async def update_expense(
-        self,expenses_repo: ExpenseRepository, expense_id: int, data: DTOData[Expense]
+        self,expenses_repo: ExpenseAsyncRepository, expense_id: int, data: DTOData[Expense]
     ) -> Expense:
         try:
-            expense, _ = expenses_repo.get_and_update(id=expense_id, **data.as_builtins(), match_fields=["id"])
-            return expense
+            return await expenses_repo.get_and_update(expense_id, **data.as_builtins())
         except NotFoundError:
             raise HTTPException(detail="User not found", status_code=404)
 
     @delete("/{expense_id:int}")
-    async def delete_expense(self, expenses_repo: ExpenseRepository, expense_id: int) -> None:
+    async def delete_expense(self, expenses_repo: ExpenseAsyncRepository, expense_id: int) -> None:
         try:
-            expenses_repo.soft_delete(expense_id)
+            await expenses_repo.soft_delete(expense_id)
         except HTTPException:
             raise HTTPException(status_code=404, detail="Gasto no encontrado.")
 
     @post("/{id:int}/pay")
-    async def pay_expense(self,id:int, request: "Request[User, Token, Any]",expenses_repo: ExpenseRepository,) -> Response[Any]:
+    async def pay_expense(
+        self, id: int, request: "Request[User, Token, Any]", expenses_repo: ExpenseAsyncRepository
+    ) -> Response[Any]:
         if not request.user:
             raise HTTPException(detail="Usuario no autenticado", status_code=401)
 
         user_id = request.user.id
-        result = expenses_repo.update_expense(id,user_id)
+        result = await expenses_repo.update_expense(id,user_id)
         return result
 
 
+class ReportController(Controller):
+    """Totals of the expenses, aggregated by the database (see `app.services.expenses.reports`)."""
+
+    path = "/reports"
+    tags = ["expenses | reports"]
+
+    @get("/{report:str}")
+    async def get_report(
+        self,
+        report: Report,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        format: ExportFormat = "ndjson",
+    ) -> Stream:
+        """Totals `monthly`, `by-creator`, `by-status` or `by-debtor` of the expenses in the date range, streamed as
+        NDJSON or CSV. `date_from` and `date_to` are dates or datetimes."""
+        statement = report_statement(
+            report, requested_datetime(date_from, "date_from"), requested_datetime(date_to, "date_to")
+        )
+        return export(statement, format, f"report-{report}")
+
+
 expenses_router = Router(
-    route_handlers=[ExpenseController],
+    route_handlers=[ExpenseController, ReportController],
     path="/expenses",
 )
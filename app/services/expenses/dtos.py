@@ -1,5 +1,13 @@
+import datetime as dt
+from functools import lru_cache
+from typing import TYPE_CHECKING, Annotated, Any, Optional, TypeAlias
+
+import msgspec
 from advanced_alchemy.extensions.litestar import SQLAlchemyDTO, SQLAlchemyDTOConfig
 
+from app.serialization import row_struct
+from app.services.accounts.dtos import UserRow
+
 from .models import Debt, Expense
 
 
@@ -11,6 +19,20 @@ class ExpenseCreateDTO(SQLAlchemyDTO[Expense]):
     config = SQLAlchemyDTOConfig(include={"title", "description", "datetime", "amount", "debts.0.user_id"})
 
 
+class DebtImport(msgspec.Struct):
+    user_id: int
+
+
+class ExpenseImport(msgspec.Struct):
+    """A row of the bulk import, with the same fields and rules as `ExpenseCreateDTO`."""
+
+    title: Annotated[str, msgspec.Meta(max_length=64)]
+    amount: int
+    description: Optional[str] = None
+    datetime: Optional[dt.datetime] = None
+    debts: list[DebtImport] = []
+
+
 class ExpenseUpdateDTO(SQLAlchemyDTO[Expense]):
     config = SQLAlchemyDTOConfig(exclude={"id", "created_by"}, partial=True)
 
@@ -28,3 +50,38 @@ class DebtCreateDTO(SQLAlchemyDTO[Debt]):
 
 class DebtUpdateDTO(SQLAlchemyDTO[Debt]):
     config = SQLAlchemyDTOConfig(exclude={"id"}, partial=True)
+
+
+# Rows encoded straight from query results, see `app.serialization`
+# (the row `version` only goes in ETags, see `app.conditional`)
+EXPENSE_RECORD_COLUMNS = [column for column in Expense.__table__.columns if column.key != "version"]
+DEBT_ROW_COLUMNS = [column for column in Debt.__table__.columns if column.key != "version"]
+# fields a client can pick with `?fields=`: the columns, plus the creator and the debts
+EXPENSE_FIELDS = [*(str(column.key) for column in EXPENSE_RECORD_COLUMNS), "created_by", "debts"]
+EXPENSE_ROW_FIELDS = [field for field in EXPENSE_FIELDS if field != "is_deleted"]
+
+
+@lru_cache
+def expense_struct(fields: tuple[str, ...], name: str = "ExpenseRow") -> type[msgspec.Struct]:
+    """Struct with the requested `fields` of an expense: its columns in table order, then `created_by` and `debts`."""
+    nested: dict[str, Any] = {}
+    if "created_by" in fields:
+        nested["created_by"] = UserRow
+    if "debts" in fields:
+        nested["debts"] = list[DebtRow]
+    return row_struct(name, [column for column in EXPENSE_RECORD_COLUMNS if column.key in fields], **nested)
+
+
+if TYPE_CHECKING:
+    DebtRow: TypeAlias = msgspec.Struct
+    ExpenseRow: TypeAlias = msgspec.Struct
+    ExpenseDetail: TypeAlias = msgspec.Struct
+    ExpenseRecord: TypeAlias = msgspec.Struct
+else:
+    DebtRow = row_struct("DebtRow", DEBT_ROW_COLUMNS)
+    # list items: the expense with its creator and debts
+    ExpenseRow = expense_struct(tuple(EXPENSE_ROW_FIELDS))
+    # a single expense, deleted or not
+    ExpenseDetail = expense_struct(tuple(EXPENSE_FIELDS), "ExpenseDetail")
+    # every column of the expense, without relationships
+    ExpenseRecord = row_struct("ExpenseRecord", EXPENSE_RECORD_COLUMNS)
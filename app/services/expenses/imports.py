@@ -0,0 +1,84 @@
+"""Bulk import of expenses, from a JSON array or an NDJSON stream (one expense per line)."""
+
+from typing import Any, AsyncIterable, AsyncIterator
+
+import msgspec
+from litestar.exceptions import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
+
+from .dtos import ExpenseImport
+from .repositories import ExpenseAsyncRepository
+
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+
+async def json_rows(body: bytes) -> AsyncIterator[bytes]:
+    """Items of a JSON array, still encoded, so each one is validated (and may fail) on its own."""
+    try:
+        items = msgspec.json.decode(body, type=list[msgspec.Raw])
+    except (msgspec.DecodeError, msgspec.ValidationError) as e:
+        raise HTTPException(detail=f"Se esperaba un arreglo JSON: {e}", status_code=400)
+    for item in items:
+        yield bytes(item)
+
+
+async def ndjson_rows(stream: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Non empty lines of an NDJSON body, as they arrive."""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def aenumerate(rows: AsyncIterable[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    i = 0
+    async for row in rows:
+        yield i, row
+        i += 1
+
+
+async def import_expenses(
+    rows: AsyncIterable[bytes], expenses_repo: ExpenseAsyncRepository, created_by_id: int, chunk_size: int
+) -> dict[str, Any]:
+    """Validate `rows` and insert the valid ones in chunks of `chunk_size`, each committed in its own transaction.
+
+    Chunks are written as the rows arrive, so neither memory nor the open transaction grows with the size of the body.
+    A chunk that fails to be written is rolled back as a whole and its rows are reported as errors; the chunks before
+    it stay committed. Rows are numbered from 0, in the order they were received.
+    """
+    imported = 0
+    errors: list[dict[str, Any]] = []
+    chunk: list[ExpenseImport] = []
+    numbers: list[int] = []
+
+    async def flush() -> None:
+        nonlocal imported
+        try:
+            count, failed = await expenses_repo.import_chunk(chunk, created_by_id)
+        except SQLAlchemyError as e:
+            count, failed = 0, {i: f"Error al guardar el lote: {e.__class__.__name__}" for i in range(len(chunk))}
+        imported += count
+        errors.extend({"row": numbers[i], "detail": detail} for i, detail in failed.items())
+        chunk.clear()
+        numbers.clear()
+
+    number = -1
+    async for number, row in aenumerate(rows):
+        try:
+            chunk.append(msgspec.json.decode(row, type=ExpenseImport))
+        except (msgspec.DecodeError, msgspec.ValidationError) as e:
+            errors.append({"row": number, "detail": str(e)})
+            continue
+        numbers.append(number)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    errors.sort(key=lambda error: error["row"])
+    return {"received": number + 1, "imported": imported, "errors": errors}
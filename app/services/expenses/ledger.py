@@ -0,0 +1,67 @@
+"""Balance ledger: what each user owes and is owed, kept up to date as debts are created, paid and deleted.
+
+Every entry is a `(debtor_id, creditor_id, amount)` tuple, where the creditor is the creator of the expense. The ledger
+tracks the unpaid debts of non deleted expenses, so balance reads are a primary key lookup instead of an aggregation
+over the whole debt history.
+"""
+
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy import ColumnElement, func, select
+from sqlalchemy.orm import Session, scoped_session
+
+from app.database import increment
+
+from .models import Debt, Expense, PairBalance, UserBalance
+
+Entry = tuple[int, int, int]
+# the session of a sync repository
+RepositorySession = Session | scoped_session[Session]
+
+
+def unpaid(session: RepositorySession, *where: ColumnElement[bool]) -> list[Entry]:
+    """Unpaid debts of non deleted expenses matching `where`, summed by debtor and creditor."""
+    statement = (
+        select(Debt.user_id, Expense.created_by_id, func.sum(Debt.amount))
+        .join(Expense, Expense.id == Debt.expense_id)
+        .where(Debt.paid_on.is_(None), Expense.is_deleted == False, *where)
+        .group_by(Debt.user_id, Expense.created_by_id)
+    )
+    return [(debtor_id, creditor_id, amount) for debtor_id, creditor_id, amount in session.execute(statement)]
+
+
+def add(session: RepositorySession, entries: Iterable[Entry]) -> None:
+    """Record new unpaid debts."""
+    pairs: defaultdict[tuple[int, int], int] = defaultdict(int)
+    owes: defaultdict[int, int] = defaultdict(int)
+    owed: defaultdict[int, int] = defaultdict(int)
+    for debtor_id, creditor_id, amount in entries:
+        pairs[debtor_id, creditor_id] += amount
+        owes[debtor_id] += amount
+        owed[creditor_id] += amount
+    increment(
+        session,
+        PairBalance,
+        ["debtor_id", "creditor_id"],
+        [
+            {"debtor_id": debtor_id, "creditor_id": creditor_id, "amount": amount}
+            for (debtor_id, creditor_id), amount in pairs.items()
+        ],
+    )
+    increment(
+        session,
+        UserBalance,
+        ["user_id"],
+        [{"user_id": user_id, "owes": owes[user_id], "owed": owed[user_id]} for user_id in owes.keys() | owed.keys()],
+    )
+
+
+def subtract(session: RepositorySession, entries: Iterable[Entry]) -> None:
+    """Remove debts that were paid or whose expense was deleted."""
+    add(session, [(debtor_id, creditor_id, -amount) for debtor_id, creditor_id, amount in entries])
+
+
+def replace(session: RepositorySession, before: Iterable[Entry], after: Iterable[Entry]) -> None:
+    """Swap the entries of a debt set that was changed in place, e.g. an expense with a new creator."""
+    add(session, [*after, *((debtor_id, creditor_id, -amount) for debtor_id, creditor_id, amount in before)])
@@ -1,9 +1,9 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import ForeignKey, String, Column, Enum, Boolean
+from sqlalchemy import ForeignKey, Index, String, Column, Enum, Boolean, false, literal_column
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from app.database import Base
+from app.database import Base, version_column
 import enum
 
 if TYPE_CHECKING:
@@ -15,8 +15,41 @@ class ExpenseStatus(enum.Enum):
     PAID = "Paid"
     CANCELED = "Canceled" 
 
+
+# predicates of the partial indexes, rendered for each dialect (`= 0` in SQLite, `= false` in PostgreSQL)
+NOT_DELETED = literal_column("is_deleted") == false()
+UNPAID = literal_column("paid_on").is_(None)
+
+
 class Expense(Base):
     __tablename__ = "expenses_expenses"
+    __table_args__ = (
+        # expenses of a user, optionally by status (`UserRepository.get_user_expenses`)
+        Index("ix_expenses_expenses_created_by_id_status", "created_by_id", "status"),
+        # listing filtered by creator and date range, and by status (`ExpenseRepository.list`)
+        Index(
+            "ix_expenses_expenses_active_created_by_id_datetime",
+            "created_by_id",
+            "datetime",
+            sqlite_where=NOT_DELETED,
+            postgresql_where=NOT_DELETED,
+        ),
+        # monthly totals over a date range (`app.services.expenses.reports`), without reading the table
+        Index(
+            "ix_expenses_expenses_active_datetime_amount",
+            "datetime",
+            "amount",
+            sqlite_where=NOT_DELETED,
+            postgresql_where=NOT_DELETED,
+        ),
+        Index(
+            "ix_expenses_expenses_active_status_id",
+            "status",
+            "id",
+            sqlite_where=NOT_DELETED,
+            postgresql_where=NOT_DELETED,
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(String(64))
@@ -26,6 +59,7 @@ class Expense(Base):
     status: Mapped[ExpenseStatus] = mapped_column(Enum(ExpenseStatus), default=ExpenseStatus.PENDING, nullable=False)
     is_deleted: Mapped[bool] = mapped_column(Boolean, default=False)
     created_by_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"))
+    version: Mapped[int] = version_column("expenses_expenses")
 
     created_by: Mapped["User"] = relationship(back_populates="created_expenses")
     debts: Mapped[list["Debt"]] = relationship(back_populates="expense", cascade="all, delete")
@@ -39,14 +73,85 @@ class Expense(Base):
 
 class Debt(Base):
     __tablename__ = "expenses_debts"
+    __table_args__ = (
+        # user_id is the second column of the primary key, so lookups by user need their own indexes
+        Index("ix_expenses_debts_user_id", "user_id"),
+        Index(
+            "ix_expenses_debts_unpaid_user_id",
+            "user_id",
+            "expense_id",
+            sqlite_where=UNPAID,
+            postgresql_where=UNPAID,
+        ),
+    )
 
     expense_id: Mapped[int] = mapped_column(ForeignKey("expenses_expenses.id"), primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
     amount: Mapped[int]
     paid_on: Mapped[Optional[datetime]]
+    version: Mapped[int] = version_column("expenses_debts")
 
     expense: Mapped["Expense"] = relationship(back_populates="debts")
     user: Mapped["User"] = relationship(back_populates="debts")
 
     def __repr__(self) -> str:
         return f"<Debt(expense_id={self.expense_id}, user_id={self.user_id}, amount={self.amount})>"
+
+
+class UserBalance(Base):
+    """Unpaid debts of a user and owed to a user, maintained by `app.services.expenses.ledger`."""
+
+    __tablename__ = "expenses_user_balances"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
+    owes: Mapped[int] = mapped_column(default=0)
+    owed: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<UserBalance(user_id={self.user_id}, owes={self.owes}, owed={self.owed})>"
+
+
+class PairBalance(Base):
+    """What `debtor` owes `creditor` in unpaid debts, maintained by `app.services.expenses.ledger`."""
+
+    __tablename__ = "expenses_pair_balances"
+    __table_args__ = (Index("ix_expenses_pair_balances_creditor_id", "creditor_id"),)
+
+    debtor_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
+    creditor_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
+    amount: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<PairBalance(debtor_id={self.debtor_id}, creditor_id={self.creditor_id}, amount={self.amount})>"
+
+
+class ExpenseRollup(Base):
+    """Count and amount of the non deleted expenses of a day by creator and status, maintained by
+    `app.services.expenses.rollups`."""
+
+    __tablename__ = "expenses_expense_rollups"
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    created_by_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
+    status: Mapped[ExpenseStatus] = mapped_column(Enum(ExpenseStatus), primary_key=True)
+    expenses: Mapped[int] = mapped_column(default=0)
+    amount: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<ExpenseRollup(day={self.day}, created_by_id={self.created_by_id}, status={self.status})>"
+
+
+class DebtRollup(Base):
+    """Count, amount and unpaid amount of the debts of the non deleted expenses of a day by debtor, maintained by
+    `app.services.expenses.rollups`."""
+
+    __tablename__ = "expenses_debt_rollups"
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("accounts_users.id"), primary_key=True)
+    debts: Mapped[int] = mapped_column(default=0)
+    amount: Mapped[int] = mapped_column(default=0)
+    unpaid: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<DebtRollup(day={self.day}, user_id={self.user_id})>"
@@ -0,0 +1,103 @@
+"""Aggregate reports of the expenses, grouped in the database and streamed like the exports.
+
+Only the non deleted expenses with a `datetime` are counted. All reports can be restricted to a range of
+`Expense.datetime` (`date_from` inclusive, `date_to` exclusive, as in the list). They are read from the daily rollups
+(see `app.services.expenses.rollups`) unless the range starts or ends in the middle of a day; then the base tables are
+grouped, through the partial indexes on `expenses_expenses`.
+"""
+
+from datetime import datetime, time
+from typing import Any, Literal, Optional
+
+from sqlalchemy import ColumnElement, Select, String, case, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import FunctionElement
+
+from .models import Debt, DebtRollup, Expense, ExpenseRollup
+
+Report = Literal["monthly", "by-creator", "by-status", "by-debtor"]
+
+
+class Month(FunctionElement[str]):
+    """Month of a timestamp as `YYYY-MM`."""
+
+    type = String()
+    name = "month"
+    inherit_cache = True
+
+
+@compiles(Month, "postgresql")
+def month_postgresql(element: Month, compiler: SQLCompiler, **kw: Any) -> str:
+    return f"to_char(date_trunc('month', {compiler.process(element.clauses, **kw)}), 'YYYY-MM')"
+
+
+@compiles(Month, "sqlite")
+def month_sqlite(element: Month, compiler: SQLCompiler, **kw: Any) -> str:
+    return f"strftime('%Y-%m', {compiler.process(element.clauses, **kw)})"
+
+
+def in_range(date_from: Optional[datetime], date_to: Optional[datetime]) -> list[ColumnElement[bool]]:
+    where = [Expense.is_deleted == False, Expense.datetime.is_not(None)]
+    if date_from is not None:
+        where.append(Expense.datetime >= date_from)
+    if date_to is not None:
+        where.append(Expense.datetime < date_to)
+    return where
+
+
+def whole_days(*bounds: Optional[datetime]) -> bool:
+    return all(bound is None or bound == datetime.combine(bound.date(), time()) for bound in bounds)
+
+
+def rollup_statement(report: Report, date_from: Optional[datetime], date_to: Optional[datetime]) -> Select[Any]:
+    """Rows of `report` summed from the rollups, for a range of whole days."""
+    if report == "by-debtor":
+        rollup: type[ExpenseRollup | DebtRollup] = DebtRollup
+        statement: Select[Any] = select(
+            DebtRollup.user_id,
+            func.sum(DebtRollup.debts).label("debts"),
+            func.sum(DebtRollup.amount).label("amount"),
+            func.sum(DebtRollup.unpaid).label("unpaid"),
+        )
+        count = DebtRollup.debts
+    else:
+        rollup = ExpenseRollup
+        key = {
+            "monthly": Month(ExpenseRollup.day).label("month"),
+            "by-creator": ExpenseRollup.created_by_id,
+            "by-status": ExpenseRollup.status,
+        }[report]
+        statement = select(
+            key, func.sum(ExpenseRollup.expenses).label("expenses"), func.sum(ExpenseRollup.amount).label("amount")
+        )
+        count = ExpenseRollup.expenses
+    if date_from is not None:
+        statement = statement.where(rollup.day >= date_from.date())
+    if date_to is not None:
+        statement = statement.where(rollup.day < date_to.date())
+    key_column = statement.selected_columns[0]
+    # rows whose expenses were all deleted or changed stay behind with zeros
+    return statement.group_by(key_column).having(func.sum(count) != 0).order_by(key_column)
+
+
+def report_statement(report: Report, date_from: Optional[datetime], date_to: Optional[datetime]) -> Select[Any]:
+    """Rows of `report`, grouped and ordered by their first column."""
+    if whole_days(date_from, date_to):
+        return rollup_statement(report, date_from, date_to)
+    if report == "by-debtor":
+        statement = select(
+            Debt.user_id,
+            func.count().label("debts"),
+            func.sum(Debt.amount).label("amount"),
+            func.coalesce(func.sum(case((Debt.paid_on.is_(None), Debt.amount))), 0).label("unpaid"),
+        ).join(Expense, Expense.id == Debt.expense_id)
+    else:
+        key = {
+            "monthly": Month(Expense.datetime).label("month"),
+            "by-creator": Expense.created_by_id,
+            "by-status": Expense.status,
+        }[report]
+        statement = select(key, func.count().label("expenses"), func.sum(Expense.amount).label("amount"))
+    key_column = statement.selected_columns[0]
+    return statement.where(*in_range(date_from, date_to)).group_by(key_column).order_by(key_column)
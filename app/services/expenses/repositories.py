@@ -1,110 +1,366 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import Optional, Any, overload
+from typing import Iterable, List, Optional, Any, Sequence, overload
+from advanced_alchemy.exceptions import NotFoundError
 from advanced_alchemy.repository import SQLAlchemySyncRepository
-from sqlalchemy.orm import Session
-import jwt
+from sqlalchemy import Select, exists, insert, select, update
+from sqlalchemy.orm import Session, joinedload, raiseload, selectinload
+from app.conditional import versions
+from app.database import AsyncRepository, DatabaseSession, run_in_new_session
+from app.pagination import keyset
+from app.response_cache import response_cache
 from app.services.accounts.models import User
 from litestar import Controller, Request, Response
-from .models import Debt, Expense
+from . import ledger, rollups
+from app.services.accounts.dtos import USER_ROW_COLUMNS, UserRow
+from .dtos import (
+    DEBT_ROW_COLUMNS,
+    EXPENSE_FIELDS,
+    EXPENSE_RECORD_COLUMNS,
+    EXPENSE_ROW_FIELDS,
+    DebtRow,
+    ExpenseDetail,
+    ExpenseImport,
+    ExpenseRow,
+    expense_struct,
+)
+from .models import Debt, Expense, ExpenseStatus
 from sqlalchemy.orm import aliased
 from litestar.exceptions import HTTPException
 
+# Loader profiles: the relationships each endpoint serializes, loaded up front in a fixed number of queries. Any other
+# relationship raises instead of lazy loading, so a new nested field can't turn into one extra query per expense.
+# Expenses (created and updated): creator joined in the same query, debts in a single `IN` query. Reads are projected
+# into `ExpenseRow`s instead, see `ExpenseRepository.project`.
+EXPENSE_LOAD = [joinedload(Expense.created_by), selectinload(Expense.debts), raiseload("*")]
+
+
+def split_amount(amount: int, user_ids: Iterable[int], created_by_id: int) -> tuple[list[int], int]:
+    """Debtors of an expense and what each one owes: the amount is split evenly among them and the creator."""
+    debtor_ids = [user_id for user_id in user_ids if user_id != created_by_id]
+    return debtor_ids, int(amount / (len(debtor_ids) + 1))
+
+
+def expenses_changed(session: ledger.RepositorySession, user_ids: Iterable[int]) -> None:
+    """Drop the cached expense lists, and the cached debts and expenses of `user_ids`, once the changes commit."""
+    response_cache.invalidate_on_commit(session, "expenses", *(f"users:{user_id}" for user_id in set(user_ids)))
+
 
 class ExpenseRepository(SQLAlchemySyncRepository[Expense]):
     model_type = Expense
 
     def create_with_debts(self, expense: Expense, created_by: User) -> Expense:
         """"""
-        debts = [d for d in expense.debts if d.user_id != created_by.id]
-        # calculate the amount per person
-        amount_per_person = int(expense.amount / (len(debts) + 1))
+        debtor_ids, amount_per_person = split_amount(expense.amount, [d.user_id for d in expense.debts], created_by.id)
         # create debts for each user
-        expense.debts = [Debt(amount=amount_per_person, user_id=d.user_id) for d in debts]
-        expense.created_by = created_by
+        expense.debts = [Debt(amount=amount_per_person, user_id=user_id) for user_id in debtor_ids]
+        # only the id: `created_by` may be a cached user that doesn't belong to this session
+        expense.created_by_id = created_by.id
         if not expense.datetime:
             expense.datetime = datetime.now()
 
-        return self.add(expense)
+        expense = self.add(expense)
+        ledger.add(self.session, [(debt.user_id, created_by.id, debt.amount) for debt in expense.debts])
+        rollups.add(self.session, [expense.id])
+        expenses_changed(self.session, [created_by.id, *debtor_ids])
+        return expense
+
+    def list(  # type: ignore[override]
+        self,
+        *,
+        cursor: Optional[int],
+        limit: int,
+        status: Optional[ExpenseStatus] = None,
+        created_by_id: Optional[int] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        min_amount: Optional[int] = None,
+        max_amount: Optional[int] = None,
+        fields: Sequence[str] = EXPENSE_ROW_FIELDS,
+    ) -> list[ExpenseRow]:
+        """Page of non deleted expenses after `cursor` matching the given filters (see `app.pagination.keyset`)."""
+        statement = select(Expense.id).where(Expense.is_deleted == False)
+        if status is not None:
+            statement = statement.where(Expense.status == status)
+        if created_by_id is not None:
+            statement = statement.where(Expense.created_by_id == created_by_id)
+        if date_from is not None:
+            statement = statement.where(Expense.datetime >= date_from)
+        if date_to is not None:
+            statement = statement.where(Expense.datetime < date_to)
+        if min_amount is not None:
+            statement = statement.where(Expense.amount >= min_amount)
+        if max_amount is not None:
+            statement = statement.where(Expense.amount <= max_amount)
+        return self.project(keyset(statement, Expense.id, cursor, limit), fields)
+
+    def get_row(self, expense_id: int, fields: Sequence[str] = EXPENSE_FIELDS) -> ExpenseDetail:
+        """Expense by id, deleted or not, with only `fields` (see `project`)."""
+        rows = self.project(select(Expense.id).where(Expense.id == expense_id), fields, "ExpenseDetail")
+        if not rows:
+            raise NotFoundError(f"No expense found with id {expense_id}")
+        return rows[0]
+
+    def get_versions(self, expense_id: int) -> tuple[int, ...]:
+        """Versions of the rows `get_row` reads: the expense, its creator and its debts (see `app.conditional`)."""
+        row = self.session.execute(
+            select(Expense.version, User.version, *versions(Debt, Debt.expense_id == Expense.id))
+            .join(User, User.id == Expense.created_by_id)
+            .where(Expense.id == expense_id)
+        ).one_or_none()
+        if row is None:
+            raise NotFoundError(f"No expense found with id {expense_id}")
+        return tuple(row)
+
+    def project(self, statement: Select[Any], fields: Sequence[str], name: str = "ExpenseRow") -> List[ExpenseRow]:
+        """Expenses selected by `statement`, with only the requested `fields` (`id` must be one of them).
+
+        Only the requested columns are selected. The creator is joined in the same query and the debts are fetched
+        in a second one, each only when asked for.
+        """
+        struct = expense_struct(tuple(fields), name)
+        columns = [column for column in EXPENSE_RECORD_COLUMNS if column.key in fields]
+        statement = statement.with_only_columns(*columns)
+        if "created_by" in fields:
+            statement = statement.add_columns(*USER_ROW_COLUMNS).join(User, User.id == Expense.created_by_id)
+        rows = self.session.execute(statement).all()
+
+        debts: defaultdict[int, List[DebtRow]] = defaultdict(list)
+        if rows and "debts" in fields:
+            debt_rows = self.session.execute(
+                select(*DEBT_ROW_COLUMNS)
+                .where(Debt.expense_id.in_([row.id for row in rows]))
+                .order_by(Debt.expense_id, Debt.user_id)
+            )
+            for debt in debt_rows:
+                debts[debt.expense_id].append(DebtRow(*debt))
+
+        split = len(columns)
+        items = []
+        for row in rows:
+            values = list(row[:split])
+            if "created_by" in fields:
+                values.append(UserRow(*row[split:]))
+            if "debts" in fields:
+                values.append(debts[row.id])
+            items.append(struct(*values))
+        return items
+
+    def import_chunk(self, rows: List[ExpenseImport], created_by_id: int) -> tuple[int, dict[int, str]]:
+        """Insert a chunk of imported expenses with their debts (`ExpenseAsyncRepository.import_chunk` commits it).
 
-    def get_one(self, id: int) -> Optional[Expense]:  # type: ignore[override]
-        """Obtiene un gasto por su ID."""
-        return self.session.query(Expense).filter_by(id=id).first()
+        Expenses and debts are written with one executemany each. Rows that reference unknown users are skipped;
+        returns the number of expenses inserted and an error for each skipped row, by its position in `rows`.
+        """
+        user_ids = {debt.user_id for row in rows for debt in row.debts}
+        known = set(self.session.scalars(select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+        errors: dict[int, str] = {}
+        for i, row in enumerate(rows):
+            debtor_ids = [debt.user_id for debt in row.debts]
+            if unknown := sorted(set(debtor_ids) - known):
+                errors[i] = f"Usuario(s) no encontrado(s): {', '.join(map(str, unknown))}"
+            elif len(set(debtor_ids)) != len(debtor_ids):
+                errors[i] = "Usuario(s) repetido(s) en las deudas"
+        rows = [row for i, row in enumerate(rows) if i not in errors]
+        if not rows:
+            return 0, errors
 
-    def list(self) -> list[Expense]: # type: ignore[override]
-        return self.session.query(Expense).filter(Expense.is_deleted == False).all()
+        now = datetime.now()
+        expense_ids = self.session.scalars(
+            insert(Expense).returning(Expense.id, sort_by_parameter_order=True),
+            [
+                {
+                    "title": row.title,
+                    "description": row.description,
+                    "datetime": row.datetime or now,
+                    "amount": row.amount,
+                    "created_by_id": created_by_id,
+                }
+                for row in rows
+            ],
+        ).all()
+        debts = []
+        for expense_id, row in zip(expense_ids, rows):
+            debtor_ids, amount = split_amount(row.amount, [debt.user_id for debt in row.debts], created_by_id)
+            debts += [{"expense_id": expense_id, "user_id": user_id, "amount": amount} for user_id in debtor_ids]
+        if debts:
+            self.session.execute(insert(Debt), debts)
+        ledger.add(self.session, [(debt["user_id"], created_by_id, debt["amount"]) for debt in debts])
+        rollups.add(self.session, expense_ids)
+        expenses_changed(self.session, [created_by_id, *(debt["user_id"] for debt in debts)])
+        return len(expense_ids), errors
+
+    def lock(self, expense_id: int) -> None:
+        """Lock the expense and its debts (SELECT ... FOR UPDATE) before reading what they add to the ledger, so that a
+        payment can't subtract the same debts in between; in the same order as `settle`, so they can't deadlock."""
+        locked = self.session.execute(
+            select(Debt.expense_id)
+            .join(Expense, Expense.id == Debt.expense_id)
+            .where(Debt.expense_id == expense_id)
+            .order_by(Debt.expense_id, Debt.user_id)
+            .with_for_update()
+        ).all()
+        if not locked:
+            self.session.execute(select(Expense.id).where(Expense.id == expense_id).with_for_update()).all()
+
+    def get_and_update_expense(self, expense_id: int, **values: Any) -> Expense:
+        """`get_and_update` keeping the ledger in sync, the update may change the creator or the deleted flag."""
+        self.lock(expense_id)
+        before = ledger.unpaid(self.session, Expense.id == expense_id)
+        user_ids = self.user_ids(expense_id)
+        # no refresh after the update: it would expire the relationships loaded for the response
+        with rollups.track(self.session, [expense_id]):
+            self.get_and_update(id=expense_id, **values, match_fields=["id"], load=EXPENSE_LOAD, auto_refresh=False)
+        ledger.replace(self.session, before, ledger.unpaid(self.session, Expense.id == expense_id))
+        expenses_changed(self.session, user_ids | self.user_ids(expense_id))
+        # the relationships were loaded before the update, e.g. `created_by` still is the old creator
+        return self.session.execute(
+            select(Expense)
+            .options(*EXPENSE_LOAD)
+            .where(Expense.id == expense_id)
+            .execution_options(populate_existing=True)
+        ).unique().scalar_one()
+
+    def user_ids(self, expense_id: int) -> set[int]:
+        """Creator and debtors of an expense."""
+        rows = self.session.execute(
+            select(Expense.created_by_id, Debt.user_id)
+            .outerjoin(Debt, Debt.expense_id == Expense.id)
+            .where(Expense.id == expense_id)
+        )
+        return {user_id for row in rows for user_id in row if user_id is not None}
 
     def get_expense_by_id(self, expense_id:int) -> Optional[Expense]:
         return self.session.query(Expense).filter(Expense.id == expense_id).one_or_none()
 
     def update(self, expense: Expense) -> None: # type: ignore[override]
         self.session.add(expense) 
-        self.session.commit()  
-
-    def update_expense(self, expense_id: int, user_id: int) ->Response[Any]:
-        """Realiza el pago de un gasto si tiene deudas asociadas para el usuario especificado."""
-        expense = self.get_expense_by_id(expense_id)
+        self.session.flush()
 
-        if not expense:
-            raise HTTPException(detail="Gasto no encontrado", status_code=404)
-
-        debts = expense.debts
-
-        if not debts:
-            raise HTTPException(detail="No hay deudas asociadas a este gasto.", status_code=400)
+    def update_expense(self, expense_id: int, user_id: int) -> Response[Any]:
+        """Realiza el pago de la deuda del usuario especificado en un gasto.
 
-        all_debts_paid = True 
+        Sólo se leen la deuda y el gasto, bloqueando sus filas (SELECT ... FOR UPDATE) para que los pagos de un mismo
+        gasto se serialicen; el estado del gasto se actualiza con un UPDATE condicional, sin cargar el resto de deudas.
+        """
+        debt = self.session.execute(
+            select(Debt.amount, Debt.paid_on, Expense.created_by_id, Expense.is_deleted)
+            .join(Expense, Expense.id == Debt.expense_id)
+            .where(Debt.expense_id == expense_id, Debt.user_id == user_id)
+            .with_for_update()
+        ).one_or_none()
 
-        for debt in debts:
-            if debt.user_id != user_id:
-                return Response(
+        if debt is None:
+            if not self.session.scalar(select(exists().where(Expense.id == expense_id))):
+                raise HTTPException(detail="Gasto no encontrado", status_code=404)
+            if not self.session.scalar(select(exists().where(Debt.expense_id == expense_id))):
+                raise HTTPException(detail="No hay deudas asociadas a este gasto.", status_code=400)
+            return Response(
                 content={"message": "La deuda no es suya, solo la puede pagar el usuario que carga con ella."},
                 status_code=403,
-                media_type="application/json"
-                )
-                
-            if debt.user_id == user_id: 
-                if debt.paid_on is None:  
-                    debt.paid_on = datetime.now()  
-                    debt.amount = 0  
-                else:
-                    all_debts_paid = False  
+                media_type="application/json",
+            )
 
-                self.session.add(debt)  
+        if debt.paid_on is not None:
+            return Response(
+                content={"message": "La deuda ya estaba pagada"},
+                status_code=200,
+                media_type="application/json",
+            )
 
-        expense.update_status()
-        self.session.add(expense)  
+        with rollups.track(self.session, [expense_id]):
+            # `paid_on IS NULL` again: without row locks (SQLite) another payment may have been committed in between
+            paid = self.session.execute(
+                update(Debt)
+                .where(Debt.expense_id == expense_id, Debt.user_id == user_id, Debt.paid_on.is_(None))
+                .values(paid_on=datetime.now(), amount=0)
+                .returning(Debt.user_id)
+            ).first()
+            if paid is not None:
+                self.update_paid_status([expense_id])
+        if paid is None:
+            return Response(
+                content={"message": "La deuda ya estaba pagada"},
+                status_code=200,
+                media_type="application/json",
+            )
 
-        self.session.commit()  
+        if not debt.is_deleted:
+            ledger.subtract(self.session, [(user_id, debt.created_by_id, debt.amount)])
+        expenses_changed(self.session, [user_id, debt.created_by_id])
 
         return Response(
             content={"message": "Deuda(s) pagada(s) correctamente"},
             status_code=200,
             media_type="application/json"
         )
-    def retrieve_user_from_token(self, token: str) -> User:
-
-        try:
-            payload = jwt.decode(token, "secret", algorithms=["HS256"])
-        except jwt.exceptions.DecodeError:
-            raise HTTPException(detail="Token invalido o incorrecto.", status_code=403)
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(detail="Token expirado.", status_code=403)
-        except jwt.InvalidTokenError:
-            raise HTTPException(detail="Token invalido.", status_code=403)
-
-            user_id: int = payload.get("sub")
-
-        if not user_id:
-            raise HTTPException(detail="Token invalido o usuario no encontrado.", status_code=403)
-        
-            user: User = self.get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(detail="Usuario no encontrado.", status_code=404)
-        
-        return user
+
+    def settle(self, user_id: int, creditor_id: Optional[int] = None) -> dict[str, Any]:
+        """Paga todas las deudas pendientes del usuario, o sólo las de los gastos de `creditor_id`, en una transacción.
+
+        Como en `update_expense`, las deudas se bloquean al leerlas y se pagan con UPDATEs sobre el conjunto completo.
+        """
+        statement = (
+            select(Debt.expense_id, Debt.amount, Expense.created_by_id)
+            .join(Expense, Expense.id == Debt.expense_id)
+            .where(Debt.user_id == user_id, Debt.paid_on.is_(None), Expense.is_deleted == False)
+            # always lock in the same order, so concurrent settles and payments can't deadlock
+            .order_by(Debt.expense_id, Debt.user_id)
+            .with_for_update()
+        )
+        if creditor_id is not None:
+            statement = statement.where(Expense.created_by_id == creditor_id)
+        debts = {expense_id: (creditor, amount) for expense_id, amount, creditor in self.session.execute(statement)}
+
+        paid_ids: list[int] = []
+        paid_expenses: list[int] = []
+        if debts:
+            with rollups.track(self.session, debts.keys()):
+                paid_ids = list(
+                    self.session.scalars(
+                        update(Debt)
+                        .where(Debt.user_id == user_id, Debt.paid_on.is_(None), Debt.expense_id.in_(debts))
+                        .values(paid_on=datetime.now(), amount=0)
+                        .returning(Debt.expense_id)
+                    )
+                )
+                paid_expenses = self.update_paid_status(paid_ids)
+        entries = [(user_id, *debts[expense_id]) for expense_id in paid_ids]
+        ledger.subtract(self.session, entries)
+        if entries:
+            expenses_changed(self.session, [user_id, *(creditor for _, creditor, _ in entries)])
+
+        by_creditor: dict[int, dict[str, int]] = {}
+        for _, creditor, amount in entries:
+            settled = by_creditor.setdefault(creditor, {"user_id": creditor, "debts": 0, "amount": 0})
+            settled["debts"] += 1
+            settled["amount"] += amount
+        return {
+            "debts": len(entries),
+            "amount": sum(amount for _, _, amount in entries),
+            "paid_expenses": paid_expenses,
+            "by_creditor": sorted(by_creditor.values(), key=lambda settled: settled["user_id"]),
+        }
+
+    def update_paid_status(self, expense_ids: List[int]) -> List[int]:
+        """Marca como pagados los gastos de `expense_ids` que ya no tienen deudas pendientes y los retorna."""
+        if not expense_ids:
+            return []
+        return list(
+            self.session.scalars(
+                update(Expense)
+                .where(
+                    Expense.id.in_(expense_ids),
+                    ~exists().where(Debt.expense_id == Expense.id, Debt.paid_on.is_(None)),
+                )
+                .values(status=ExpenseStatus.PAID)
+                .returning(Expense.id)
+            )
+        )
 
     def soft_delete(self, expense_id: int) -> Response[Any]:
         """Marca el gasto como eliminado en lugar de eliminarlo físicamente."""
+        self.lock(expense_id)
         expense = self.get_expense_by_id(expense_id)
         if not expense:
             return Response(
@@ -113,9 +369,13 @@ class ExpenseRepository(SQLAlchemySyncRepository[Expense]):
             media_type="application/json"
         )
 
-        expense.is_deleted = True
-        self.session.add(expense)
-        self.session.commit()
+        if not expense.is_deleted:
+            ledger.subtract(self.session, ledger.unpaid(self.session, Expense.id == expense_id))
+        with rollups.track(self.session, [expense_id]):
+            expense.is_deleted = True
+            self.session.add(expense)
+            self.session.flush()
+        expenses_changed(self.session, self.user_ids(expense_id))
         return Response(
             content={"message": "Gasto borrado correctamente"},
             status_code=200,
@@ -127,8 +387,51 @@ class DebtRepository(SQLAlchemySyncRepository[Debt]):
     model_type = Debt
 
 
-async def provide_expense_repository(db_session: Session) -> ExpenseRepository:
-    return ExpenseRepository(session=db_session)
+class ExpenseAsyncRepository(AsyncRepository[ExpenseRepository]):
+    """Awaitable version of `ExpenseRepository`, used by the controllers."""
+
+    repository_type = ExpenseRepository
+
+    async def list(self, **filters: Any) -> list[ExpenseRow]:
+        return await self.run(lambda repo: repo.list(**filters))
+
+    async def get(self, expense_id: int) -> Expense:
+        """Retrieve an expense with its creator and debts loaded, ready to be serialized."""
+        return await self.run(lambda repo: repo.get(expense_id, load=EXPENSE_LOAD))
+
+    async def get_row(self, expense_id: int, fields: Sequence[str]) -> ExpenseDetail:
+        return await self.run(lambda repo: repo.get_row(expense_id, fields))
+
+    async def get_versions(self, expense_id: int) -> tuple[int, ...]:
+        return await self.run(ExpenseRepository.get_versions, expense_id)
+
+    async def create_with_debts(self, expense: Expense, created_by: User) -> Expense:
+        expense = await self.run(ExpenseRepository.create_with_debts, expense, created_by)
+        # columns filled in by the database are not loaded on the new instances yet
+        return await self.get(expense.id)
+
+    async def get_and_update(self, expense_id: int, **values: Any) -> Expense:
+        return await self.run(lambda repo: repo.get_and_update_expense(expense_id, **values))
+
+    async def import_chunk(self, rows: List[ExpenseImport], created_by_id: int) -> tuple[int, dict[int, str]]:
+        """Insert and commit a chunk in a session of its own, so a large import doesn't keep a single transaction (and
+        its locks) open until the request ends; a chunk that fails is rolled back without the others."""
+        return await run_in_new_session(
+            lambda session: ExpenseRepository(session=session).import_chunk(rows, created_by_id)
+        )
+
+    async def update_expense(self, expense_id: int, user_id: int) -> Response[Any]:
+        return await self.run(ExpenseRepository.update_expense, expense_id, user_id)
+
+    async def settle(self, user_id: int, creditor_id: Optional[int] = None) -> dict[str, Any]:
+        return await self.run(ExpenseRepository.settle, user_id, creditor_id)
+
+    async def soft_delete(self, expense_id: int) -> Response[Any]:
+        return await self.run(ExpenseRepository.soft_delete, expense_id)
+
+
+async def provide_expense_repository(db_session: DatabaseSession) -> ExpenseAsyncRepository:
+    return ExpenseAsyncRepository(session=db_session)
 
 
 async def provide_debt_repository(db_session: Session) -> DebtRepository:
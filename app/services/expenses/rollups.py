@@ -0,0 +1,184 @@
+"""Daily rollups of the expenses and their debts, so that the reports read a few rows per day, not the base tables.
+
+`ExpenseRollup` has the count and amount of the non deleted expenses by day, creator and status, and `DebtRollup` the
+debts of those expenses by day and debtor. Write paths keep them up to date like the ledger keeps the balances: the
+contributions of the expenses they touch are read before and after the change (`track`) and the difference is added.
+Expenses without a `datetime` have no day, so they are not counted.
+
+`litestar rollups rebuild` recomputes both tables from the base tables, after bulk loads that skip the write paths.
+"""
+
+import time
+from collections import defaultdict
+from collections.abc import Collection, Iterator
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, TypeVar
+
+import click
+from click import Group
+from litestar.plugins import CLIPluginProtocol
+from sqlalchemy import Date, case, create_engine, delete, func, insert, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import FunctionElement
+
+from app.config import settings
+from app.database import increment
+
+from .ledger import RepositorySession
+from .models import Debt, DebtRollup, Expense, ExpenseRollup, ExpenseStatus
+
+KeyT = TypeVar("KeyT", bound=tuple[Any, ...])
+ExpenseKey = tuple[date, int, ExpenseStatus]
+DebtKey = tuple[date, int]
+# (count, amount) by expense key, and (count, amount, unpaid) by debt key
+Contributions = tuple[dict[ExpenseKey, list[int]], dict[DebtKey, list[int]]]
+
+
+class Day(FunctionElement[date]):
+    """Day of a timestamp."""
+
+    type = Date()
+    name = "day"
+    inherit_cache = True
+
+
+@compiles(Day)
+def day_default(element: Day, compiler: SQLCompiler, **kw: Any) -> str:
+    return f"CAST({compiler.process(element.clauses, **kw)} AS DATE)"
+
+
+@compiles(Day, "sqlite")
+def day_sqlite(element: Day, compiler: SQLCompiler, **kw: Any) -> str:
+    # the format SQLAlchemy stores dates with in SQLite
+    return f"date({compiler.process(element.clauses, **kw)})"
+
+
+def contributions(session: RepositorySession, expense_ids: Collection[int]) -> Contributions:
+    """What the expenses of `expense_ids` and their debts add to the rollups, as they are now."""
+    expenses: defaultdict[ExpenseKey, list[int]] = defaultdict(lambda: [0, 0])
+    debts: defaultdict[DebtKey, list[int]] = defaultdict(lambda: [0, 0, 0])
+    if not expense_ids:
+        return expenses, debts
+    rows = session.execute(
+        select(
+            Expense.id,
+            Expense.datetime,
+            Expense.created_by_id,
+            Expense.status,
+            Expense.amount,
+            Debt.user_id,
+            Debt.amount,
+            Debt.paid_on,
+        )
+        .outerjoin(Debt, Debt.expense_id == Expense.id)
+        .where(Expense.id.in_(expense_ids), Expense.is_deleted == False, Expense.datetime.is_not(None))
+    )
+    counted: set[int] = set()
+    for expense_id, created_at, created_by_id, status, amount, user_id, debt_amount, paid_on in rows:
+        if expense_id not in counted:
+            counted.add(expense_id)
+            totals = expenses[created_at.date(), created_by_id, status]
+            totals[0] += 1
+            totals[1] += amount
+        if user_id is not None:
+            totals = debts[created_at.date(), user_id]
+            totals[0] += 1
+            totals[1] += debt_amount
+            totals[2] += debt_amount if paid_on is None else 0
+    return expenses, debts
+
+
+def differences(before: dict[KeyT, list[int]], after: dict[KeyT, list[int]], size: int) -> Iterator[tuple[Any, ...]]:
+    """`(*key, *totals)` of the keys whose totals changed, with the totals as increments."""
+    for key in before.keys() | after.keys():
+        totals = [new - old for new, old in zip(after.get(key, [0] * size), before.get(key, [0] * size))]
+        if any(totals):
+            yield *key, *totals
+
+
+def apply(session: RepositorySession, before: Contributions, after: Contributions) -> None:
+    """Add the difference between two `contributions` of the same expenses to the rollups."""
+    expense_columns = ["day", "created_by_id", "status", "expenses", "amount"]
+    debt_columns = ["day", "user_id", "debts", "amount", "unpaid"]
+    increment(
+        session,
+        ExpenseRollup,
+        expense_columns[:3],
+        [dict(zip(expense_columns, row)) for row in differences(before[0], after[0], 2)],
+    )
+    increment(
+        session,
+        DebtRollup,
+        debt_columns[:2],
+        [dict(zip(debt_columns, row)) for row in differences(before[1], after[1], 3)],
+    )
+
+
+def add(session: RepositorySession, expense_ids: Collection[int]) -> None:
+    """Count new expenses, once they and their debts are flushed."""
+    apply(session, ({}, {}), contributions(session, expense_ids))
+
+
+@contextmanager
+def track(session: RepositorySession, expense_ids: Collection[int]) -> Iterator[None]:
+    """Update the rollups with the changes made to the expenses of `expense_ids` (or their debts) inside the block."""
+    before = contributions(session, expense_ids)
+    yield
+    # the query flushes the changes first
+    apply(session, before, contributions(session, expense_ids))
+
+
+def rebuild(session: Session) -> None:
+    """Recompute the rollups from the base tables, with one INSERT ... SELECT each."""
+    created_on = Day(Expense.datetime)
+    active = (Expense.is_deleted == False, Expense.datetime.is_not(None))
+    session.execute(delete(ExpenseRollup))
+    session.execute(delete(DebtRollup))
+    session.execute(
+        insert(ExpenseRollup).from_select(
+            ["day", "created_by_id", "status", "expenses", "amount"],
+            select(created_on, Expense.created_by_id, Expense.status, func.count(), func.sum(Expense.amount))
+            .where(*active)
+            .group_by(created_on, Expense.created_by_id, Expense.status),
+        )
+    )
+    session.execute(
+        insert(DebtRollup).from_select(
+            ["day", "user_id", "debts", "amount", "unpaid"],
+            select(
+                created_on,
+                Debt.user_id,
+                func.count(),
+                func.sum(Debt.amount),
+                func.sum(case((Debt.paid_on.is_(None), Debt.amount), else_=0)),
+            )
+            .join(Expense, Expense.id == Debt.expense_id)
+            .where(*active)
+            .group_by(created_on, Debt.user_id),
+        )
+    )
+
+
+class RollupsCLIPlugin(CLIPluginProtocol):
+    def on_cli_init(self, cli: Group) -> None:
+        @cli.group(name="rollups")
+        def rollups_group() -> None:
+            """Daily rollups of the expenses read by the reports."""
+
+        @rollups_group.command(name="rebuild")
+        def rebuild_command() -> None:
+            """Recompute the rollups from the expenses and debts, in one transaction."""
+            engine = create_engine(settings.database_url.unicode_string())
+            started = time.perf_counter()
+            with Session(engine) as session, session.begin():
+                rebuild(session)
+                expenses = session.scalar(select(func.count()).select_from(ExpenseRollup))
+                debts = session.scalar(select(func.count()).select_from(DebtRollup))
+            engine.dispose()
+            click.echo(f"{expenses} expense rollups, {debts} debt rollups in {time.perf_counter() - started:.1f} s")
+
+
+rollups_plugin = RollupsCLIPlugin()
@@ -0,0 +1,82 @@
+"""Streaming of query results as NDJSON or CSV, in batches so memory use doesn't grow with the number of rows."""
+
+import csv
+import io
+from collections.abc import AsyncIterator, Callable, Iterator, Sequence
+from datetime import datetime
+from enum import Enum
+from typing import Any, Literal
+
+import msgspec
+from litestar.response import Stream
+from sqlalchemy import Select
+
+from app.config import settings
+from app.database import stream_partitions
+
+ExportFormat = Literal["ndjson", "csv"]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def ndjson_encoder(keys: list[str]) -> Callable[[Sequence[Sequence[Any]]], bytes]:
+    def encode(rows: Sequence[Sequence[Any]]) -> bytes:
+        return b"".join(msgspec.json.encode(dict(zip(keys, row))) + b"\n" for row in rows)
+
+    return encode
+
+
+def csv_value(value: Any) -> Any:
+    """Same text as the NDJSON export for the values that `csv` would write with `str()`."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_encoder(keys: list[str]) -> Callable[[Sequence[Sequence[Any]]], bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([csv_value(value) for value in row] for row in rows)
+        return buffer.getvalue().encode()
+
+    return encode
+
+
+def export(statement: Select[Any], format: ExportFormat, filename: str) -> Stream:
+    """Stream the rows of `statement`, one chunk per batch of `settings.export_batch_size` rows."""
+    keys = list(statement.selected_columns.keys())
+    encode = ndjson_encoder(keys) if format == "ndjson" else csv_encoder(keys)
+    # the CSV header goes in the first chunk, so that an empty export is still a valid file
+    header = encode([keys]) if format == "csv" else b""
+    partitions = stream_partitions(statement, settings.export_batch_size)
+    content: Iterator[bytes] | AsyncIterator[bytes]
+
+    if isinstance(partitions, Iterator):
+        sync_partitions = partitions
+
+        def chunks() -> Iterator[bytes]:
+            yield header
+            for partition in sync_partitions:
+                yield encode(partition)
+
+        content = chunks()
+    else:
+        async_partitions = partitions
+
+        async def async_chunks() -> AsyncIterator[bytes]:
+            yield header
+            async for partition in async_partitions:
+                yield encode(partition)
+
+        content = async_chunks()
+
+    return Stream(
+        content,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+    )
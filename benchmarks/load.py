@@ -0,0 +1,263 @@
+# ruff: noqa: T201
+"""Load test of the API: latency percentiles, throughput and statements per request for the main scenarios.
+
+The real app is driven in-process by a single client (litestar's `TestClient`) against a database seeded with
+`--users` users and `--expenses` expenses, each with `--debtors` debts:
+
+- `login`: `POST /accounts/auth/login` (argon2 included).
+- `create_expense`: `POST /expenses/expenses` with `--debtors` debtors.
+- `list_expenses`: `GET /expenses/expenses`, walking the pages with the cursor.
+- `pay`: `POST /expenses/expenses/{id}/pay` by one of the debtors.
+- `user_summary`: `GET /accounts/users/{id}`.
+
+Results can be saved as a baseline (`--save-baseline`) and later runs compared against it: a scenario regresses when
+its p95 is more than `--threshold` slower, or its throughput that much lower; the exit status is 1 then. Baselines
+are only comparable on the same machine and with the same options, which are stored with them.
+
+The response cache is disabled unless `--response-cache` is given, so the requests reach the database.
+
+Usage:
+    uv run python benchmarks/load.py --requests 500 --save-baseline
+    uv run python benchmarks/load.py --requests 500 --baseline benchmarks/baselines/load-sqlite.json
+    uv run python benchmarks/load.py --database-url postgresql+psycopg://localhost/benchmark --async
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+BASELINES = ROOT / "benchmarks" / "baselines"
+PASSWORD = "benchmark"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--expenses", type=int, default=10_000)
+    parser.add_argument("--debtors", type=int, default=2, help="debts of each expense")
+    parser.add_argument("--requests", type=int, default=200, help="requests of each scenario")
+    parser.add_argument("--scenarios", nargs="+", help="run only these scenarios")
+    parser.add_argument(
+        "--database-url", help="an empty database to use instead of a temporary SQLite one, its tables are created"
+    )
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the asyncio engine")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--baseline", type=Path, help="compare the results with this baseline")
+    parser.add_argument(
+        "--save-baseline",
+        nargs="?",
+        type=Path,
+        const=BASELINES / "load-sqlite.json",
+        help="save the results as a baseline (default: %(const)s)",
+    )
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, 0.2 is 20%%")
+    return parser.parse_args()
+
+
+def seed(users: int, expenses: int, debtors: int) -> None:
+    """Create the tables and fill them; debts are split like `ExpenseRepository.create_with_debts` does."""
+    from sqlalchemy import create_engine, func, insert, select
+    from sqlalchemy.orm import Session
+
+    import app.services  # noqa: F401
+    from app.database import Base
+    from app.services.accounts.hashing import password_hasher
+    from app.services.accounts.models import User
+    from app.services.expenses import ledger, rollups
+    from app.services.expenses.models import Debt, Expense
+    from app.services.expenses.repositories import split_amount
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        if session.scalar(select(func.count()).select_from(User)):
+            sys.exit("The database must be empty")
+        password = password_hasher.hash(PASSWORD)
+        session.execute(
+            insert(User),
+            [
+                {
+                    "id": i,
+                    "username": f"user{i}",
+                    "full_name": f"User {i}",
+                    "email": f"user{i}@example.com",
+                    "password": password,
+                }
+                for i in range(1, users + 1)
+            ],
+        )
+        session.execute(
+            insert(Expense),
+            [
+                {"id": i, "title": f"expense {i}", "amount": 300, "created_by_id": (i - 1) % users + 1}
+                for i in range(1, expenses + 1)
+            ],
+        )
+        debts = []
+        for i in range(1, expenses + 1):
+            created_by_id = (i - 1) % users + 1
+            user_ids = [(created_by_id + j) % users + 1 for j in range(debtors)]
+            debtor_ids, amount = split_amount(300, user_ids, created_by_id)
+            debts += [{"expense_id": i, "user_id": user_id, "amount": amount} for user_id in debtor_ids]
+        session.execute(insert(Debt), debts)
+        ledger.add(session, [(debt["user_id"], (debt["expense_id"] - 1) % users + 1, debt["amount"]) for debt in debts])
+        rollups.rebuild(session)
+        session.commit()
+    engine.dispose()
+
+
+def scenarios(client: Any, tokens: dict[int, str], args: argparse.Namespace) -> dict[str, Iterator[Callable[[], Any]]]:
+    """The requests of each scenario, as functions that send one and return the response."""
+    users = itertools.cycle(range(1, args.users + 1))
+
+    def headers(user_id: int) -> dict[str, str]:
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    def login() -> Iterator[Callable[[], Any]]:
+        for user_id in users:
+            yield lambda: client.post(
+                "/accounts/auth/login", data={"username": f"user{user_id}", "password": PASSWORD}
+            )
+
+    def create_expense() -> Iterator[Callable[[], Any]]:
+        for user_id in users:
+            debts = [{"user_id": (user_id + j) % args.users + 1} for j in range(args.debtors)]
+            body = {"title": "load test", "amount": 300, "debts": debts}
+            yield lambda: client.post("/expenses/expenses", json=body, headers=headers(user_id))
+
+    def list_expenses() -> Iterator[Callable[[], Any]]:
+        cursor = None
+
+        def next_page() -> Any:
+            nonlocal cursor
+            response = client.get("/expenses/expenses", params={"cursor": cursor} if cursor else {}, headers=headers(1))
+            cursor = response.json()["cursor"] if response.is_success else None
+            return response
+
+        while True:
+            yield next_page
+
+    def pay() -> Iterator[Callable[[], Any]]:
+        # the seeded debts of the expenses created by user 1, in order: each one can only be paid once
+        for expense_id in range(1, args.expenses + 1, args.users):
+            for j in range(args.debtors):
+                debtor = (1 + j) % args.users + 1
+                if debtor != 1:
+                    yield lambda: client.post(f"/expenses/expenses/{expense_id}/pay", headers=headers(debtor))
+
+    def user_summary() -> Iterator[Callable[[], Any]]:
+        for user_id in users:
+            yield lambda: client.get(f"/accounts/users/{user_id}", headers=headers(user_id))
+
+    return {
+        "login": login(),
+        "create_expense": create_expense(),
+        "list_expenses": list_expenses(),
+        "pay": pay(),
+        "user_summary": user_summary(),
+    }
+
+
+def run(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    from litestar.testing import TestClient
+
+    from app import app
+    from app.metrics import REQUEST_QUERIES
+
+    results: dict[str, dict[str, float]] = {}
+    with TestClient(app) as client:
+        tokens = {}
+        for user_id in range(1, args.users + 1):
+            response = client.post("/accounts/auth/login", data={"username": f"user{user_id}", "password": PASSWORD})
+            tokens[user_id] = response.raise_for_status().json()["access_token"]
+
+        for name, requests in scenarios(client, tokens, args).items():
+            if args.scenarios and name not in args.scenarios:
+                continue
+            requests_before, queries_before = REQUEST_QUERIES.totals()
+            timings = []
+            started = time.perf_counter()
+            for send in itertools.islice(requests, args.requests):
+                start = time.perf_counter()
+                response = send()
+                timings.append(time.perf_counter() - start)
+                response.raise_for_status()
+            elapsed = time.perf_counter() - started
+            requests_after, queries_after = REQUEST_QUERIES.totals()
+            requests_count, queries = requests_after - requests_before, queries_after - queries_before
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+            results[name] = {
+                "requests": len(timings),
+                "p50_ms": percentiles[49] * 1000,
+                "p95_ms": percentiles[94] * 1000,
+                "p99_ms": percentiles[98] * 1000,
+                "requests_per_second": len(timings) / elapsed,
+                "queries_per_request": queries / requests_count if requests_count else 0.0,
+            }
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, Any], threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+        if result["requests_per_second"] < before["requests_per_second"] / (1 + threshold):
+            regressions.append(
+                f"{name}: {before['requests_per_second']:.0f} req/s -> {result['requests_per_second']:.0f} req/s"
+            )
+    return regressions
+
+
+def main() -> None:
+    args = parse_args()
+    if args.database_url is None:
+        args.database_url = f"sqlite:///{Path(tempfile.mkdtemp()) / 'benchmark.sqlite3'}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["DATABASE_ASYNC"] = "true" if args.use_async else "false"
+    if not args.response_cache:
+        os.environ["RESPONSE_CACHE_TTL"] = "0"
+    options = {
+        key: getattr(args, key) for key in ("users", "expenses", "debtors", "requests", "use_async", "response_cache")
+    }
+    options["backend"] = args.database_url.split(":", 1)[0].split("+", 1)[0]
+
+    seed(args.users, args.expenses, args.debtors)
+    results = run(args)
+
+    print(f"{'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<16}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['requests_per_second']:>10.0f}{result['queries_per_request']:>10.1f}"
+        )
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps({"options": options, "results": results}, indent=2) + "\n")
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["options"] != options:
+            print(f"Warning: the baseline was run with {baseline['options']}")
+        if regressions := compare(results, baseline, args.threshold):
+            print("Regressions:", *regressions, sep="\n  ")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
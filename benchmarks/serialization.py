@@ -0,0 +1,102 @@
+# ruff: noqa: T201
+"""Compare the DTO serialization of expense lists with the projected `ExpenseRow` path.
+
+Both endpoints return the same expenses (with their creator and debts) from a temporary SQLite database:
+
+- `/dto`: ORM objects loaded with `EXPENSE_LOAD` and serialized by `ExpensesDTO`, as the list endpoint used to do.
+- `/rows`: `ExpenseRepository.list`, which encodes msgspec structs built from the result tuples.
+
+Usage:
+    uv run python benchmarks/serialization.py --rows 10000 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+DATABASE = Path(tempfile.mkdtemp()) / "benchmark.sqlite3"
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ["DATABASE_ASYNC"] = "false"
+
+from litestar import Litestar, get  # noqa: E402
+from litestar.testing import TestClient  # noqa: E402
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import app.services  # noqa: E402, F401
+from app.database import Base, sqlalchemy_plugin  # noqa: E402
+from app.services.accounts.models import User  # noqa: E402
+from app.services.expenses.dtos import ExpenseRow, ExpensesDTO  # noqa: E402
+from app.services.expenses.models import Debt, Expense  # noqa: E402
+from app.services.expenses.repositories import EXPENSE_LOAD, ExpenseRepository  # noqa: E402
+
+
+def populate(rows: int) -> None:
+    engine = create_engine(os.environ["DATABASE_URL"])
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {
+                    "id": i,
+                    "username": f"user{i}",
+                    "full_name": f"User {i}",
+                    "email": f"user{i}@example.com",
+                    "password": "x",
+                }
+                for i in (1, 2, 3)
+            ],
+        )
+        connection.execute(
+            insert(Expense),
+            [{"id": i, "title": f"expense {i}", "amount": 300, "created_by_id": 1} for i in range(1, rows + 1)],
+        )
+        connection.execute(
+            insert(Debt),
+            [{"expense_id": i, "user_id": user_id, "amount": 100} for i in range(1, rows + 1) for user_id in (2, 3)],
+        )
+
+
+def create_app(rows: int) -> Litestar:
+    @get("/dto", return_dto=ExpensesDTO, sync_to_thread=True)
+    def dto(db_session: Session) -> list[Expense]:
+        statement = select(Expense).where(Expense.is_deleted == False).order_by(Expense.id).limit(rows)
+        return list(db_session.scalars(statement.options(*EXPENSE_LOAD)))
+
+    @get("/rows", sync_to_thread=True)
+    def projected(db_session: Session) -> list[ExpenseRow]:
+        return ExpenseRepository(session=db_session).list(cursor=None, limit=rows)
+
+    return Litestar(route_handlers=[dto, projected], plugins=[sqlalchemy_plugin])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    populate(args.rows)
+    with TestClient(create_app(args.rows)) as client:
+        for path in ("/dto", "/rows"):
+            client.get(path).raise_for_status()  # warm up
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(path)
+                timings.append(time.perf_counter() - start)
+                response.raise_for_status()
+            print(
+                f"{path:6} {len(response.json()):>7} expenses  {len(response.content) / 1024:>9.0f} KiB  "
+                f"median {statistics.median(timings) * 1000:>8.1f} ms  min {min(timings) * 1000:>8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
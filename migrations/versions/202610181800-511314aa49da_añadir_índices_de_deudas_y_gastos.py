@@ -0,0 +1,55 @@
+"""añadir índices de deudas y gastos
+
+Revision ID: 511314aa49da
+Revises: 9beed7460b0d
+Create Date: 2026-10-18 18:00:12.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '511314aa49da'
+down_revision: Union[str, None] = '9beed7460b0d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOT_DELETED = sa.literal_column('is_deleted') == sa.false()
+UNPAID = sa.literal_column('paid_on').is_(None)
+
+
+def upgrade() -> None:
+    op.create_index('ix_expenses_expenses_created_by_id_status', 'expenses_expenses', ['created_by_id', 'status'])
+    op.create_index(
+        'ix_expenses_expenses_active_created_by_id_datetime',
+        'expenses_expenses',
+        ['created_by_id', 'datetime'],
+        sqlite_where=NOT_DELETED,
+        postgresql_where=NOT_DELETED,
+    )
+    op.create_index(
+        'ix_expenses_expenses_active_status_id',
+        'expenses_expenses',
+        ['status', 'id'],
+        sqlite_where=NOT_DELETED,
+        postgresql_where=NOT_DELETED,
+    )
+    op.create_index('ix_expenses_debts_user_id', 'expenses_debts', ['user_id'])
+    op.create_index(
+        'ix_expenses_debts_unpaid_user_id',
+        'expenses_debts',
+        ['user_id', 'expense_id'],
+        sqlite_where=UNPAID,
+        postgresql_where=UNPAID,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_expenses_debts_unpaid_user_id', table_name='expenses_debts')
+    op.drop_index('ix_expenses_debts_user_id', table_name='expenses_debts')
+    op.drop_index('ix_expenses_expenses_active_status_id', table_name='expenses_expenses')
+    op.drop_index('ix_expenses_expenses_active_created_by_id_datetime', table_name='expenses_expenses')
+    op.drop_index('ix_expenses_expenses_created_by_id_status', table_name='expenses_expenses')
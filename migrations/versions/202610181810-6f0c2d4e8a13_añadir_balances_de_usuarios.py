@@ -0,0 +1,67 @@
+"""añadir balances de usuarios
+
+Revision ID: 6f0c2d4e8a13
+Revises: 511314aa49da
+Create Date: 2026-10-18 18:10:41.502117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f0c2d4e8a13'
+down_revision: Union[str, None] = '511314aa49da'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'expenses_user_balances',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('owes', sa.Integer(), nullable=False),
+        sa.Column('owed', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['accounts_users.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_table(
+        'expenses_pair_balances',
+        sa.Column('debtor_id', sa.Integer(), nullable=False),
+        sa.Column('creditor_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['debtor_id'], ['accounts_users.id']),
+        sa.ForeignKeyConstraint(['creditor_id'], ['accounts_users.id']),
+        sa.PrimaryKeyConstraint('debtor_id', 'creditor_id'),
+    )
+    op.create_index('ix_expenses_pair_balances_creditor_id', 'expenses_pair_balances', ['creditor_id'])
+    # the ledger starts with the unpaid debts of the existing expenses
+    op.execute(
+        """
+        INSERT INTO expenses_pair_balances (debtor_id, creditor_id, amount)
+        SELECT d.user_id, e.created_by_id, SUM(d.amount)
+        FROM expenses_debts d JOIN expenses_expenses e ON e.id = d.expense_id
+        WHERE d.paid_on IS NULL AND e.is_deleted = false
+        GROUP BY d.user_id, e.created_by_id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO expenses_user_balances (user_id, owes, owed)
+        SELECT user_id, SUM(owes), SUM(owed)
+        FROM (
+            SELECT debtor_id AS user_id, amount AS owes, 0 AS owed FROM expenses_pair_balances
+            UNION ALL
+            SELECT creditor_id, 0, amount FROM expenses_pair_balances
+        ) AS entries
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_expenses_pair_balances_creditor_id', table_name='expenses_pair_balances')
+    op.drop_table('expenses_pair_balances')
+    op.drop_table('expenses_user_balances')
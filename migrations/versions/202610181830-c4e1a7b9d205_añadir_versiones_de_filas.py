@@ -0,0 +1,30 @@
+"""añadir versiones de filas
+
+Revision ID: c4e1a7b9d205
+Revises: 6f0c2d4e8a13
+Create Date: 2026-10-18 18:30:07.264815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e1a7b9d205'
+down_revision: Union[str, None] = '6f0c2d4e8a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['accounts_users', 'expenses_expenses', 'expenses_debts']
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_column(table, 'version')
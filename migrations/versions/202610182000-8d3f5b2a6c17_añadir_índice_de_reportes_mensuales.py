@@ -0,0 +1,34 @@
+"""añadir índice de reportes mensuales
+
+Revision ID: 8d3f5b2a6c17
+Revises: c4e1a7b9d205
+Create Date: 2026-10-18 20:00:41.508213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f5b2a6c17'
+down_revision: Union[str, None] = 'c4e1a7b9d205'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOT_DELETED = sa.literal_column('is_deleted') == sa.false()
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_expenses_expenses_active_datetime_amount',
+        'expenses_expenses',
+        ['datetime', 'amount'],
+        sqlite_where=NOT_DELETED,
+        postgresql_where=NOT_DELETED,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_expenses_expenses_active_datetime_amount', table_name='expenses_expenses')
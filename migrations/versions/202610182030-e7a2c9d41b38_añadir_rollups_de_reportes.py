@@ -0,0 +1,72 @@
+"""añadir rollups de reportes
+
+Revision ID: e7a2c9d41b38
+Revises: 8d3f5b2a6c17
+Create Date: 2026-10-18 20:30:17.842906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a2c9d41b38'
+down_revision: Union[str, None] = '8d3f5b2a6c17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the type already exists, it's the one of expenses_expenses.status
+EXPENSE_STATUS = sa.Enum('PENDING', 'PAID', 'CANCELED', name='expensestatus').with_variant(
+    postgresql.ENUM('PENDING', 'PAID', 'CANCELED', name='expensestatus', create_type=False), 'postgresql'
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'expenses_expense_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('created_by_id', sa.Integer(), nullable=False),
+        sa.Column('status', EXPENSE_STATUS, nullable=False),
+        sa.Column('expenses', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['created_by_id'], ['accounts_users.id']),
+        sa.PrimaryKeyConstraint('day', 'created_by_id', 'status'),
+    )
+    op.create_table(
+        'expenses_debt_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('debts', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('unpaid', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['accounts_users.id']),
+        sa.PrimaryKeyConstraint('day', 'user_id'),
+    )
+    # the rollups start with the existing expenses, like `litestar rollups rebuild` computes them
+    day = 'date(e.datetime)' if op.get_bind().dialect.name == 'sqlite' else 'CAST(e.datetime AS DATE)'
+    op.execute(
+        f"""
+        INSERT INTO expenses_expense_rollups (day, created_by_id, status, expenses, amount)
+        SELECT {day}, e.created_by_id, e.status, COUNT(*), SUM(e.amount)
+        FROM expenses_expenses e
+        WHERE e.is_deleted = false AND e.datetime IS NOT NULL
+        GROUP BY {day}, e.created_by_id, e.status
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO expenses_debt_rollups (day, user_id, debts, amount, unpaid)
+        SELECT {day}, d.user_id, COUNT(*), SUM(d.amount), SUM(CASE WHEN d.paid_on IS NULL THEN d.amount ELSE 0 END)
+        FROM expenses_debts d JOIN expenses_expenses e ON e.id = d.expense_id
+        WHERE e.is_deleted = false AND e.datetime IS NOT NULL
+        GROUP BY {day}, d.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('expenses_debt_rollups')
+    op.drop_table('expenses_expense_rollups')
@@ -0,0 +1,96 @@
+import os
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import pytest
+from sqlalchemy import Engine, event
+
+# the settings are read when `app` is imported, so the test database has to be configured first
+DATABASE = os.path.join(tempfile.mkdtemp(), "test.sqlite3")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ["DATABASE_ASYNC"] = "false"
+# cached responses and background writes would make the number of statements depend on the order of the requests
+os.environ["RESPONSE_CACHE_TTL"] = "0"
+os.environ["LAST_LOGIN_FLUSH_INTERVAL"] = "3600"
+
+PASSWORD = "secreta"
+USERS = 41
+
+
+def login(client: Any, username: str) -> dict[str, str]:
+    """Headers of a request authenticated as `username`."""
+    response = client.post("/accounts/auth/login", data={"username": username, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class QueryCounter:
+    """Statements executed through an engine, counted with a `before_cursor_execute` listener."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.statements: list[str] = []
+
+    def listener(self, connection: Any, cursor: Any, statement: str, *_: Any) -> None:
+        self.statements.append(statement)
+
+    @contextmanager
+    def count(self) -> Iterator[list[str]]:
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self.listener)
+        try:
+            yield self.statements
+        finally:
+            event.remove(self.engine, "before_cursor_execute", self.listener)
+
+
+@pytest.fixture(scope="session")
+def engine() -> Engine:
+    from app.database import engine
+
+    assert isinstance(engine, Engine)
+    return engine
+
+
+@pytest.fixture(scope="session")
+def client(engine: Engine) -> Iterator[Any]:
+    from litestar.testing import TestClient
+
+    from app import app
+    from app.database import Base
+
+    Base.metadata.create_all(engine)
+    with TestClient(app) as client:
+        yield client
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture(scope="session")
+def queries(client: Any, engine: Engine) -> QueryCounter:
+    return QueryCounter(engine)
+
+
+@pytest.fixture(scope="session")
+def user_ids(client: Any, engine: Engine) -> list[int]:
+    """Ids of the users created for the tests, the first one is the one logged in by `auth`."""
+    from sqlalchemy import insert, select
+    from sqlalchemy.orm import Session
+
+    from app.services.accounts.hashing import password_hasher
+    from app.services.accounts.models import User
+
+    password = password_hasher.hash(PASSWORD)
+    rows = [
+        {"username": f"user{i}", "full_name": f"Usuario {i}", "email": f"user{i}@example.com", "password": password}
+        for i in range(USERS)
+    ]
+    with Session(engine) as session, session.begin():
+        session.execute(insert(User), rows)
+        return list(session.scalars(select(User.id).order_by(User.id)))
+
+
+@pytest.fixture(scope="session")
+def auth(client: Any, user_ids: list[int]) -> dict[str, str]:
+    return login(client, "user0")
@@ -0,0 +1,45 @@
+"""Authentication from the token claims, and revocation of the tokens of deactivated users."""
+
+from typing import Any
+
+import anyio
+import pytest
+from litestar.exceptions import NotAuthorizedException
+
+from app.services.accounts.models import User
+from app.services.accounts.security import retrieve_user_handler
+from app.services.accounts.tokens import token_service
+
+from .conftest import PASSWORD, QueryCounter, login
+
+
+def test_principal_from_claims(client: Any, queries: QueryCounter, auth: dict[str, str], user_ids: list[int]) -> None:
+    token = token_service.verify(auth["Authorization"].removeprefix("Bearer "))
+    # the connection (and its session) isn't used when the token has the claims
+    connection: Any = None
+    with queries.count() as statements:
+        user = anyio.run(retrieve_user_handler, token, connection)
+    assert statements == []
+    assert (user.id, user.username, user.is_active) == (user_ids[0], "user0", True)
+
+
+def test_deactivated_user_is_rejected(client: Any, auth: dict[str, str]) -> None:
+    user = {"username": "temporal", "full_name": "Temporal", "email": "temporal@example.com", "password": PASSWORD}
+    response = client.post("/accounts/users", json=user, headers=auth)
+    assert response.status_code == 201, response.text
+    headers = login(client, "temporal")
+    assert client.get("/accounts/users/me", headers=headers).status_code == 200
+    assert client.delete(f"/accounts/users/{response.json()['id']}", headers=auth).status_code == 204
+    assert client.get("/accounts/users/me", headers=headers).status_code == 401
+    assert client.post("/accounts/auth/login", data={"username": "temporal", "password": PASSWORD}).status_code == 403
+
+
+def test_token_issued_after_revocation(client: Any, user_ids: list[int]) -> None:
+    user = User(id=user_ids[40], username="user40", is_active=True)
+    revoked, _ = token_service.create(user)
+    token_service.revoke_user(user.id)
+    # `iat` is in whole seconds, so this one is most likely issued in the same second as the revocation
+    issued, _ = token_service.create(user)
+    with pytest.raises(NotAuthorizedException):
+        token_service.verify(revoked)
+    assert token_service.verify(issued).sub == "user40"
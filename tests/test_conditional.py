@@ -0,0 +1,27 @@
+"""ETags and 304 responses of the detail reads (see `app.conditional`)."""
+
+from typing import Any
+
+from .conftest import login
+
+
+def test_current_user_not_modified(client: Any, user_ids: list[int]) -> None:
+    headers = login(client, "user30")
+    response = client.get("/accounts/users/me", headers=headers)
+    assert response.status_code == 200
+    tag = response.headers["ETag"]
+
+    response = client.get("/accounts/users/me", headers={**headers, "If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+    assert response.content == b""
+    # weak comparison, and one of several tags
+    response = client.get("/accounts/users/me", headers={**headers, "If-None-Match": f'"otro", W/{tag}'})
+    assert response.status_code == 304
+
+    # a new expense of the user changes the representation
+    expense = {"title": "Gasto", "amount": 100, "debts": [{"user_id": user_ids[31]}]}
+    assert client.post("/expenses/expenses", json=expense, headers=headers).status_code == 201
+    response = client.get("/accounts/users/me", headers={**headers, "If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
@@ -0,0 +1,17 @@
+"""Responses of the expense write endpoints."""
+
+from typing import Any
+
+
+def test_update_creator(client: Any, auth: dict[str, str], user_ids: list[int]) -> None:
+    expense = {"title": "Cena", "amount": 900, "debts": [{"user_id": user_ids[1]}, {"user_id": user_ids[2]}]}
+    created = client.post("/expenses/expenses", json=expense, headers=auth).json()
+    assert created["created_by"]["id"] == user_ids[0]
+
+    response = client.patch(f"/expenses/expenses/{created['id']}", json={"created_by_id": user_ids[3]}, headers=auth)
+    assert response.status_code == 200, response.text
+    updated = response.json()
+    assert updated["created_by_id"] == user_ids[3]
+    assert updated["created_by"]["id"] == user_ids[3]
+    assert updated["created_by"]["username"] == "user3"
+    assert sorted(debt["user_id"] for debt in updated["debts"]) == user_ids[1:3]
@@ -0,0 +1,77 @@
+"""Bulk imports of expenses, written and committed chunk by chunk."""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import msgspec
+from sqlalchemy import Engine, event, func, select
+from sqlalchemy.orm import Session
+
+from app.services.expenses.models import Debt, Expense
+
+
+@contextmanager
+def count_commits(engine: Engine) -> Iterator[list[None]]:
+    commits: list[None] = []
+
+    def listener(connection: Any) -> None:
+        commits.append(None)
+
+    event.listen(engine, "commit", listener)
+    try:
+        yield commits
+    finally:
+        event.remove(engine, "commit", listener)
+
+
+def expense_rows(count: int, debtor_id: int) -> list[dict[str, Any]]:
+    return [{"title": f"Importado {i}", "amount": 100, "debts": [{"user_id": debtor_id}]} for i in range(count)]
+
+
+def test_json_chunks_are_committed(client: Any, engine: Engine, auth: dict[str, str], user_ids: list[int]) -> None:
+    rows = expense_rows(5, user_ids[1])
+    with count_commits(engine) as commits:
+        response = client.post("/expenses/expenses/import?chunk_size=2", json=rows, headers=auth)
+    assert response.status_code == 201, response.text
+    assert response.json() == {"received": 5, "imported": 5, "errors": []}
+    # one transaction per chunk, not a single one for the whole request
+    assert len(commits) >= 3
+
+
+def test_ndjson_chunks_are_committed(client: Any, engine: Engine, auth: dict[str, str], user_ids: list[int]) -> None:
+    body = b"".join(msgspec.json.encode(row) + b"\n" for row in expense_rows(5, user_ids[1]))
+    headers = {**auth, "Content-Type": "application/x-ndjson"}
+    with count_commits(engine) as commits:
+        response = client.post("/expenses/expenses/import?chunk_size=2", content=body, headers=headers)
+    assert response.status_code == 201, response.text
+    assert response.json() == {"received": 5, "imported": 5, "errors": []}
+    assert len(commits) >= 3
+
+
+def test_partial_failure(client: Any, engine: Engine, auth: dict[str, str], user_ids: list[int]) -> None:
+    rows: list[Any] = [
+        {"title": "Bueno 1", "amount": 300, "debts": [{"user_id": user_ids[1]}, {"user_id": user_ids[2]}]},
+        {"title": "Deudor desconocido", "amount": 100, "debts": [{"user_id": 999_999}]},
+        {"title": "Sin monto", "debts": []},
+        {"title": "Bueno 2", "amount": 200, "debts": []},
+        {"title": "Deudor repetido", "amount": 100, "debts": [{"user_id": user_ids[1]}, {"user_id": user_ids[1]}]},
+        "no es un gasto",
+        {"title": "Bueno 3", "amount": 100, "debts": [{"user_id": user_ids[3]}]},
+    ]
+    response = client.post("/expenses/expenses/import?chunk_size=2", json=rows, headers=auth)
+    assert response.status_code == 201, response.text
+    result = response.json()
+    assert (result["received"], result["imported"]) == (7, 3)
+    assert [error["row"] for error in result["errors"]] == [1, 2, 4, 5]
+    assert "999999" in result["errors"][0]["detail"]
+
+    with Session(engine) as session:
+        imported = session.execute(
+            select(Expense.title, func.count(Debt.user_id))
+            .outerjoin(Debt, Debt.expense_id == Expense.id)
+            .where(Expense.title.in_([row["title"] for row in rows if isinstance(row, dict)]))
+            .group_by(Expense.title)
+            .order_by(Expense.title)
+        ).all()
+    assert [tuple(row) for row in imported] == [("Bueno 1", 2), ("Bueno 2", 0), ("Bueno 3", 1)]
@@ -0,0 +1,27 @@
+"""Buffered last logins are written in a batch, and the cached principals of those users dropped."""
+
+from typing import Any
+
+import anyio
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+
+from app.services.accounts.cache import principal_cache
+from app.services.accounts.last_login import last_login_buffer
+from app.services.accounts.models import User
+
+from .conftest import login
+
+
+def test_flush_invalidates_the_principal(client: Any, engine: Engine, user_ids: list[int]) -> None:
+    login(client, "user39")
+    with Session(engine) as session:
+        user = session.scalars(select(User).where(User.id == user_ids[39])).one()
+        assert user.last_login is None
+        principal_cache.set(user)
+    assert principal_cache.get("user39") is not None
+
+    assert anyio.run(last_login_buffer.flush) >= 1
+    with Session(engine) as session:
+        assert session.scalars(select(User.last_login).where(User.id == user_ids[39])).one() is not None
+    assert principal_cache.get("user39") is None
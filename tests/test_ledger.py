@@ -0,0 +1,120 @@
+"""The balance ledger matches the unpaid debts after every write path, and payments lock rows in a fixed order."""
+
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from sqlalchemy import Engine, event, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from app.services.expenses import ledger
+from app.services.expenses.models import PairBalance, UserBalance
+
+from .conftest import login
+
+Balances = tuple[dict[tuple[int, int], int], dict[int, tuple[int, int]]]
+
+
+def stored(engine: Engine) -> Balances:
+    """`expenses_pair_balances` and `expenses_user_balances`, without the rows that went back to zero."""
+    with Session(engine) as session:
+        pairs = {(row.debtor_id, row.creditor_id): row.amount for row in session.scalars(select(PairBalance))}
+        users = {row.user_id: (row.owes, row.owed) for row in session.scalars(select(UserBalance))}
+    return (
+        {pair: amount for pair, amount in pairs.items() if amount},
+        {user_id: totals for user_id, totals in users.items() if any(totals)},
+    )
+
+
+def recomputed(engine: Engine) -> Balances:
+    """The same balances, summed from scratch from the unpaid debts of the non deleted expenses."""
+    with Session(engine) as session:
+        entries = ledger.unpaid(session)
+    pairs: defaultdict[tuple[int, int], int] = defaultdict(int)
+    owes: defaultdict[int, int] = defaultdict(int)
+    owed: defaultdict[int, int] = defaultdict(int)
+    for debtor_id, creditor_id, amount in entries:
+        pairs[debtor_id, creditor_id] += amount
+        owes[debtor_id] += amount
+        owed[creditor_id] += amount
+    return (
+        {pair: amount for pair, amount in pairs.items() if amount},
+        {user_id: (owes[user_id], owed[user_id]) for user_id in owes.keys() | owed.keys()},
+    )
+
+
+@contextmanager
+def locking_statements(engine: Engine) -> Iterator[list[str]]:
+    """SELECT ... FOR UPDATE statements executed in the block, compiled for PostgreSQL (SQLite has no row locks)."""
+    statements: list[str] = []
+
+    def listener(connection: Any, clause: Any, *_: Any) -> None:
+        if getattr(clause, "_for_update_arg", None) is not None:
+            statements.append(str(clause.compile(dialect=postgresql.dialect())))
+
+    event.listen(engine, "before_execute", listener)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_execute", listener)
+
+
+def create_expense(client: Any, headers: dict[str, str], amount: int, debtor_ids: list[int]) -> int:
+    expense = {"title": "Gasto", "amount": amount, "debts": [{"user_id": user_id} for user_id in debtor_ids]}
+    response = client.post("/expenses/expenses", json=expense, headers=headers)
+    assert response.status_code == 201, response.text
+    return int(response.json()["id"])
+
+
+def test_ledger_matches_the_debts(client: Any, engine: Engine, auth: dict[str, str], user_ids: list[int]) -> None:
+    creator, debtor, other = user_ids[10:13]
+    creator_auth, debtor_auth = login(client, "user10"), login(client, "user11")
+
+    first = create_expense(client, creator_auth, 900, [debtor, other])
+    second = create_expense(client, creator_auth, 500, [debtor])
+    third = create_expense(client, debtor_auth, 300, [creator, other])
+    assert stored(engine) == recomputed(engine)
+    assert stored(engine)[0][debtor, creator] == 300 + 250
+
+    # pay a single debt
+    response = client.post(f"/expenses/expenses/{first}/pay", headers=debtor_auth)
+    assert response.status_code == 200, response.text
+    assert stored(engine) == recomputed(engine)
+
+    # delete, and bring back, an expense with unpaid debts
+    assert client.delete(f"/expenses/expenses/{third}", headers=auth).status_code == 204
+    assert stored(engine) == recomputed(engine)
+    assert (other, debtor) not in stored(engine)[0]
+    response = client.patch(f"/expenses/expenses/{third}", json={"is_deleted": False}, headers=auth)
+    assert response.status_code == 200, response.text
+    assert stored(engine) == recomputed(engine)
+    assert stored(engine)[0][other, debtor] == 100
+
+    # move an expense to another creator
+    response = client.patch(f"/expenses/expenses/{second}", json={"created_by_id": other}, headers=auth)
+    assert response.status_code == 200, response.text
+    assert stored(engine) == recomputed(engine)
+
+    # settle everything the debtor owes
+    response = client.post("/accounts/users/me/settle", headers=debtor_auth)
+    assert response.status_code == 200, response.text
+    assert response.json()["debts"] == 1
+    assert stored(engine) == recomputed(engine)
+    assert not any(pair[0] == debtor for pair in stored(engine)[0])
+
+
+def test_debts_are_locked_in_key_order(client: Any, engine: Engine, user_ids: list[int]) -> None:
+    creator_auth, debtor_auth = login(client, "user20"), login(client, "user21")
+    expense_ids = [create_expense(client, creator_auth, 200, [user_ids[21], user_ids[22]]) for _ in range(3)]
+
+    with locking_statements(engine) as statements:
+        assert client.post("/accounts/users/me/settle", headers=debtor_auth).status_code == 200
+    assert len(statements) == 1
+    assert "ORDER BY expenses_debts.expense_id, expenses_debts.user_id FOR UPDATE" in statements[0]
+
+    with locking_statements(engine) as statements:
+        assert client.delete(f"/expenses/expenses/{expense_ids[0]}", headers=creator_auth).status_code == 204
+    assert "ORDER BY expenses_debts.expense_id, expenses_debts.user_id FOR UPDATE" in statements[0]
+    assert stored(engine) == recomputed(engine)
@@ -0,0 +1,14 @@
+"""Labels and access of `/metrics`."""
+
+from typing import Any
+
+
+def test_route_labels(client: Any, auth: dict[str, str], user_ids: list[int]) -> None:
+    assert client.get(f"/accounts/users/{user_ids[1]}/debts", headers=auth).status_code == 200
+    metrics = client.get("/metrics", headers=auth).text
+    assert 'http_request_db_queries_count{route="/accounts/users/{user_id:int}/debts"}' in metrics
+    assert 'route="/accounts/users/{user_id:int}/debts/export"' not in metrics
+
+
+def test_requires_token(client: Any) -> None:
+    assert client.get("/metrics").status_code == 401
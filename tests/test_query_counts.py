@@ -0,0 +1,72 @@
+"""The hot read endpoints run a fixed number of statements, however many rows they return (no N+1 queries)."""
+
+from typing import Any
+
+from .conftest import QueryCounter
+
+SIZES = [1, 10, 40]
+
+
+def count_statements(client: Any, queries: QueryCounter, url: str, headers: dict[str, str]) -> tuple[int, Any]:
+    """Statements run by a GET of `url`, after a first request that warms up the principal cache."""
+    assert client.get(url, headers=headers).status_code == 200
+    with queries.count() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.text
+    return len(statements), response.json()
+
+
+def create_expenses(client: Any, auth: dict[str, str], count: int, debtors: list[int]) -> list[int]:
+    ids = []
+    for i in range(count):
+        expense = {"title": f"Gasto {i}", "amount": 1000, "debts": [{"user_id": user_id} for user_id in debtors]}
+        response = client.post("/expenses/expenses", json=expense, headers=auth)
+        assert response.status_code == 201, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+
+def test_expense_list(client: Any, queries: QueryCounter, auth: dict[str, str], user_ids: list[int]) -> None:
+    counts = []
+    # other tests share the database, only the expenses created here are listed
+    first_id = max(create_expenses(client, auth, 1, user_ids[1:3]))
+    expenses = 1
+    for size in SIZES:
+        expenses += len(create_expenses(client, auth, size - expenses, user_ids[1:3]))
+        # every field, including the creator and the debts
+        count, page = count_statements(client, queries, f"/expenses/expenses?limit=100&cursor={first_id - 1}", auth)
+        assert len(page["items"]) == size
+        assert all(len(item["debts"]) == 2 and item["created_by"] for item in page["items"])
+        counts.append(count)
+    assert counts[0] > 0
+    assert counts == [counts[0]] * len(SIZES)
+
+
+def test_expense_detail(client: Any, queries: QueryCounter, auth: dict[str, str], user_ids: list[int]) -> None:
+    counts = []
+    for size in SIZES:
+        (expense_id,) = create_expenses(client, auth, 1, user_ids[1 : size + 1])
+        count, expense = count_statements(client, queries, f"/expenses/expenses/{expense_id}", auth)
+        assert len(expense["debts"]) == size
+        counts.append(count)
+    assert counts == [counts[0]] * len(SIZES)
+
+
+def test_current_user(client: Any, queries: QueryCounter, auth: dict[str, str], user_ids: list[int]) -> None:
+    counts = []
+    for size in SIZES:
+        create_expenses(client, auth, size, user_ids[1:2])
+        count, user = count_statements(client, queries, "/accounts/users/me", auth)
+        assert user["username"] == "user0"
+        counts.append(count)
+    assert counts == [counts[0]] * len(SIZES)
+
+
+def test_user_list(client: Any, queries: QueryCounter, auth: dict[str, str]) -> None:
+    counts = []
+    for size in SIZES:
+        count, page = count_statements(client, queries, f"/accounts/users?limit={size}", auth)
+        assert len(page["items"]) == size
+        counts.append(count)
+    assert counts[0] > 0
+    assert counts == [counts[0]] * len(SIZES)
@@ -0,0 +1,77 @@
+"""The daily rollups match the base tables, so the reports give the same totals whichever they read."""
+
+from collections.abc import Sequence
+from typing import Any
+
+import msgspec
+import pytest
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+
+from app.services.expenses import rollups
+from app.services.expenses.models import DebtRollup, ExpenseRollup
+
+from .conftest import login
+
+REPORTS = ["monthly", "by-creator", "by-status", "by-debtor"]
+
+
+def rollup_rows(session: Session) -> tuple[Sequence[Any], Sequence[Any]]:
+    """Rows of both rollup tables, without the ones left at zero by deleted or changed expenses."""
+    expenses = session.execute(
+        select(
+            ExpenseRollup.day,
+            ExpenseRollup.created_by_id,
+            ExpenseRollup.status,
+            ExpenseRollup.expenses,
+            ExpenseRollup.amount,
+        )
+        .where(ExpenseRollup.expenses != 0)
+        .order_by(ExpenseRollup.day, ExpenseRollup.created_by_id, ExpenseRollup.status)
+    ).all()
+    debts = session.execute(
+        select(DebtRollup.day, DebtRollup.user_id, DebtRollup.debts, DebtRollup.amount, DebtRollup.unpaid)
+        .where(DebtRollup.debts != 0)
+        .order_by(DebtRollup.day, DebtRollup.user_id)
+    ).all()
+    return expenses, debts
+
+
+def report(client: Any, headers: dict[str, str], name: str, query: str = "") -> list[dict[str, Any]]:
+    response = client.get(f"/expenses/reports/{name}{query}", headers=headers)
+    assert response.status_code == 200, response.text
+    return [msgspec.json.decode(line) for line in response.content.splitlines()]
+
+
+@pytest.fixture(scope="module")
+def expenses(client: Any, user_ids: list[int]) -> None:
+    """Expenses of several creators and debtors, some paid, changed or deleted."""
+    headers = login(client, "user35")
+    created = []
+    for i in range(6):
+        expense = {"title": f"Gasto {i}", "amount": 100 * (i + 1), "debts": [{"user_id": user_ids[36 + i % 3]}]}
+        response = client.post("/expenses/expenses", json=expense, headers=headers)
+        assert response.status_code == 201, response.text
+        created.append(response.json()["id"])
+    assert client.post(f"/expenses/expenses/{created[0]}/pay", headers=login(client, "user36")).status_code == 200
+    assert client.patch(f"/expenses/expenses/{created[1]}", json={"amount": 50}, headers=headers).status_code == 200
+    assert client.delete(f"/expenses/expenses/{created[2]}", headers=headers).status_code == 204
+
+
+def test_rollups_match_the_base_tables(engine: Engine, expenses: None) -> None:
+    with Session(engine) as session:
+        maintained = rollup_rows(session)
+        rollups.rebuild(session)
+        rebuilt = rollup_rows(session)
+        session.rollback()
+    assert maintained[0] and maintained[1]
+    assert maintained == rebuilt
+
+
+@pytest.mark.parametrize("name", REPORTS)
+def test_rollups_and_base_tables_agree(client: Any, auth: dict[str, str], expenses: None, name: str) -> None:
+    # whole days are read from the rollups, a range that starts or ends within a day from the base tables
+    whole_days = report(client, auth, name, "?date_from=2000-01-01&date_to=2100-01-01")
+    partial_days = report(client, auth, name, "?date_from=2000-01-01T00:00:01&date_to=2100-01-01T00:00:01")
+    assert whole_days
+    assert whole_days == partial_days
@@ -0,0 +1,9 @@
+"""Configuration of the response cache."""
+
+from app.response_cache import cache_ttl
+
+
+def test_memory_store_is_disabled_with_several_workers() -> None:
+    assert cache_ttl("memory", 60, 1) == 60
+    assert cache_ttl("memory", 60, 4) == 0
+    assert cache_ttl("redis://localhost:6379/0", 60, 4) == 60